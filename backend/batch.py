@@ -0,0 +1,273 @@
+"""Bulk ingest: analyze many videos under several analysis types from the command line.
+
+Runs the same extract_frames_smart/process_frames pipeline and cache as the /upload
+endpoint. Frame extraction and model calls run concurrently with separate limits,
+and every finished (source, analysis type) pair is appended to a manifest so a
+crashed or interrupted run resumes where it stopped.
+
+Usage (from the backend directory, like the server):
+    python batch.py /data/shift-clips --analysis-types general,technical_analysis,robot_performance
+    python batch.py --url-list urls.txt --analysis-types auto --model-workers 2
+"""
+import argparse
+import asyncio
+import json
+import os
+import sqlite3
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+import main
+
+VIDEO_EXTENSIONS = {".mp4", ".mov", ".avi", ".webm", ".mkv", ".m4v", ".ts"}
+
+class Manifest:
+    """Append-only JSONL record of finished items, keyed by (source, analysis_type)."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self.done = set()
+        if self.path.exists():
+            with self.path.open("r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        continue  # Line torn by a crash mid-write
+                    if entry.get("status") == "ok":
+                        self.done.add((entry["source"], entry["analysis_type"]))
+
+    def is_done(self, source, analysis_type):
+        return (source, analysis_type) in self.done
+
+    def record(self, source, analysis_type, status, **fields):
+        entry = {"source": source, "analysis_type": analysis_type, "status": status,
+                 "finished_at": time.time(), **fields}
+        with self.path.open("a") as f:
+            f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        if status == "ok":
+            self.done.add((source, analysis_type))
+
+class BatchStats:
+    def __init__(self):
+        self.started_at = time.monotonic()
+        self.videos_done = 0  # At least one analysis succeeded
+        self.videos_failed = 0
+        self.videos_skipped = 0
+        self.items_ok = 0
+        self.items_failed = 0
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def report(self):
+        minutes = max(time.monotonic() - self.started_at, 1e-6) / 60
+        tokens = main.model_usage["prompt_tokens"] + main.model_usage["completion_tokens"]
+        lookups = self.cache_hits + self.cache_misses
+        hit_rate = self.cache_hits / lookups if lookups else 0.0
+        print()
+        print(f"Finished in {minutes:.1f} min")
+        print(f"  videos:      {self.videos_done} processed, {self.videos_failed} failed, "
+              f"{self.videos_skipped} already in manifest")
+        print(f"  analyses:    {self.items_ok} ok, {self.items_failed} failed")
+        print(f"  throughput:  {self.videos_done / minutes:.2f} videos/min, {tokens / minutes:.0f} tokens/min")
+        print(f"  model calls: {main.model_usage['requests']} ({tokens} tokens)")
+        print(f"  cache:       {self.cache_hits} hits, {self.cache_misses} misses ({hit_rate:.0%} hit rate)")
+
+def collect_sources(paths, url_list):
+    sources = []
+    for path in paths:
+        if "://" in path:
+            sources.append(path)
+        elif os.path.isdir(path):
+            for root, _, files in os.walk(path):
+                for name in sorted(files):
+                    if Path(name).suffix.lower() in VIDEO_EXTENSIONS:
+                        sources.append(os.path.abspath(os.path.join(root, name)))
+        elif os.path.isfile(path):
+            sources.append(os.path.abspath(path))
+        else:
+            print(f"Skipping missing path: {path}")
+    if url_list:
+        with open(url_list, "r") as f:
+            sources.extend(line.strip() for line in f if line.strip() and not line.startswith("#"))
+    return sources
+
+def build_result(source, is_url, extracted_frames, analysis, analysis_type, custom_prompt, fingerprint_match):
+    # Same shape /upload caches for URLs and file uploads, so cache entries are interchangeable
+    result = {
+        "frames_extracted": len(extracted_frames),
+        "analysis": analysis,
+        "analysis_type": analysis_type,
+    }
+    if not is_url:
+        result = {"chunk_number": 1, "total_chunks": 1, **result}
+    if fingerprint_match:
+        result["fingerprint_match"] = fingerprint_match
+    result["filename"] = source if is_url else os.path.basename(source)
+    return result
+
+def record_source_failure(source, analysis_types, manifest, stats, error, cache_keys=None):
+    """Mark every analysis type of a source as failed without stopping the rest of the run."""
+    for index, analysis_type in enumerate(analysis_types):
+        stats.items_failed += 1
+        fields = {"cache_key": cache_keys[index]} if cache_keys else {}
+        manifest.record(source, analysis_type, "error", error=str(error), **fields)
+    print(f"[failed] {source}: {error}")
+
+def prepare_frames(source, is_url, workspace):
+    """Download (for URLs) and extract frames. Runs in the extraction pool; returns (video_path, frames)."""
+    video_path = main.download_video(source, workspace) if is_url else source
+    return video_path, main.extract_frames_smart(video_path, workspace.mkdir("frames"))
+
+async def process_source(source, args, manifest, stats, extract_pool, model_semaphore):
+    is_url = "://" in source
+    analysis_types = [t for t in args.analysis_types if not manifest.is_done(source, t)]
+    if not analysis_types:
+        stats.videos_skipped += 1
+        return
+
+    loop = asyncio.get_event_loop()
+    prompts = [f"{analysis_type}_{args.custom_prompt}" for analysis_type in analysis_types]
+    try:
+        if is_url:
+            cache_keys = [main.get_cache_key(source.encode(), prompt) for prompt in prompts]
+        else:
+            # Hashed once, in chunks, and shared by every analysis type
+            file_hash = await loop.run_in_executor(extract_pool, main.get_file_hash, source)
+            cache_keys = [main.cache_key_from_hash(file_hash, prompt) for prompt in prompts]
+    except Exception as e:
+        record_source_failure(source, analysis_types, manifest, stats, e)
+        stats.videos_failed += 1
+        return
+
+    # Serve what the cache already has before paying for extraction
+    pending = []
+    for analysis_type, cache_key in zip(analysis_types, cache_keys):
+        if main.get_cached_result(cache_key):
+            stats.cache_hits += 1
+            stats.items_ok += 1
+            manifest.record(source, analysis_type, "ok", cache_key=cache_key, cached=True)
+        else:
+            pending.append((analysis_type, cache_key))
+    cached_any = len(pending) < len(analysis_types)
+
+    if not pending:
+        stats.videos_done += 1
+        return
+
+    expected_bytes = main.SCRATCH_FRAMES_ESTIMATE + (main.SCRATCH_DOWNLOAD_ESTIMATE if is_url else 0)
+    workspace = None
+    try:
+        try:
+            workspace = await main.workspace_manager.acquire(expected_bytes)
+            video_path, extracted_frames = await loop.run_in_executor(
+                extract_pool, prepare_frames, source, is_url, workspace)
+        except Exception as e:
+            stats.cache_misses += len(pending)
+            record_source_failure(source, [t for t, _ in pending], manifest, stats, e, [k for _, k in pending])
+            # Cached analyses of this source still succeeded
+            if cached_any:
+                stats.videos_done += 1
+            else:
+                stats.videos_failed += 1
+            return
+
+        async def run_analysis(analysis_type, cache_key):
+            async with model_semaphore:
+                await main.wait_for_rate_limit()
+                analysis, fingerprint_match = await main.analyze_frames(
+                    extracted_frames, analysis_type, args.custom_prompt, cache_key, video_path)
+            # Reusing a near-duplicate's analysis is a cache hit too
+            if fingerprint_match:
+                stats.cache_hits += 1
+            else:
+                stats.cache_misses += 1
+            if not isinstance(analysis, str):
+                error = analysis.get("error") if isinstance(analysis, dict) else str(analysis)
+                stats.items_failed += 1
+                manifest.record(source, analysis_type, "error", cache_key=cache_key, error=error)
+                print(f"[failed] {source} ({analysis_type}): {error}")
+                return False
+            result = build_result(source, is_url, extracted_frames, analysis, analysis_type,
+                                  args.custom_prompt, fingerprint_match)
+            main.save_to_cache(cache_key, result)
+            try:
+                main.record_history(result, cache_key, source, "batch", args.custom_prompt)
+            except sqlite3.Error as e:
+                print(f"Failed to record history for {source}: {e}")
+            stats.items_ok += 1
+            manifest.record(source, analysis_type, "ok", cache_key=cache_key, cached=False)
+            print(f"[done] {source} ({analysis_type})")
+            return True
+
+        succeeded = await asyncio.gather(*[run_analysis(t, k) for t, k in pending])
+        # Throughput only counts videos that produced at least one analysis
+        if cached_any or any(succeeded):
+            stats.videos_done += 1
+        else:
+            stats.videos_failed += 1
+    finally:
+        if workspace is not None:
+            main.workspace_manager.release(workspace)
+
+async def run_batch(args):
+    sources = collect_sources(args.sources, args.url_list)
+    if not sources:
+        print("No videos found.")
+        return 1
+
+    manifest = Manifest(args.manifest)
+    stats = BatchStats()
+    model_semaphore = asyncio.Semaphore(args.model_workers)
+    # Bounds how many videos are read, downloaded or extracted at once
+    source_semaphore = asyncio.Semaphore(args.extract_workers * 2)
+    print(f"Analyzing {len(sources)} videos x {len(args.analysis_types)} analysis types "
+          f"({args.extract_workers} extraction workers, {args.model_workers} model workers)")
+
+    main.workspace_manager.sweep_orphans()
+    with ThreadPoolExecutor(max_workers=args.extract_workers) as extract_pool:
+        async def bounded(source):
+            async with source_semaphore:
+                try:
+                    await process_source(source, args, manifest, stats, extract_pool, model_semaphore)
+                except Exception as e:
+                    # One bad source must not abort the whole run
+                    pending = [t for t in args.analysis_types if not manifest.is_done(source, t)]
+                    record_source_failure(source, pending, manifest, stats, e)
+                    stats.videos_failed += 1
+
+        try:
+            await asyncio.gather(*[bounded(source) for source in sources])
+        finally:
+            stats.report()
+    return 1 if stats.items_failed else 0
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze a directory of videos or a list of URLs in bulk")
+    parser.add_argument("sources", nargs="*", help="Video files, directories (walked recursively) or URLs")
+    parser.add_argument("--url-list", help="File with one video URL per line")
+    parser.add_argument("--analysis-types", default="auto",
+                        help="Comma-separated analysis types (default: auto)")
+    parser.add_argument("--custom-prompt", default="", help="Prompt used with the 'custom' analysis type")
+    parser.add_argument("--extract-workers", type=int, default=2, help="Concurrent downloads/frame extractions")
+    parser.add_argument("--model-workers", type=int, default=4, help="Concurrent model calls")
+    parser.add_argument("--manifest", default="batch_manifest.jsonl",
+                        help="Resume manifest; finished items listed here are skipped")
+    args = parser.parse_args(argv)
+
+    args.analysis_types = [t.strip() for t in args.analysis_types.split(",") if t.strip()]
+    unknown = [t for t in args.analysis_types if t not in main.ANALYSIS_TYPES]
+    if unknown:
+        parser.error(f"Unknown analysis type(s): {', '.join(unknown)}")
+    if not args.sources and not args.url_list:
+        parser.error("Provide at least one source or --url-list")
+    if args.extract_workers < 1 or args.model_workers < 1:
+        parser.error("Worker counts must be at least 1")
+    return args
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(run_batch(parse_args())))
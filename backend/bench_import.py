@@ -0,0 +1,59 @@
+"""Import-time benchmark for the backend.
+
+Imports `main` in fresh interpreters and reports the wall time, plus any heavy
+subsystem modules that were loaded eagerly (there should be none).
+
+Usage:
+    python bench_import.py [--runs 5]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).resolve().parent
+
+# Runs in a child interpreter so every measurement is a true cold import
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import main
+elapsed = time.perf_counter() - start
+eager = {name: [m for m in modules if m in sys.modules] for name, modules in main.SUBSYSTEMS.items()}
+print(json.dumps({"seconds": elapsed, "eager": {k: v for k, v in eager.items() if v}}))
+"""
+
+def measure_once():
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=BACKEND_DIR,
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        raise RuntimeError(f"Importing main failed:\n{result.stderr}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark cold import time of the backend")
+    parser.add_argument("--runs", type=int, default=5, help="Number of fresh interpreters to time")
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    times = [sample["seconds"] * 1000 for sample in samples]
+
+    print(f"import main: median {statistics.median(times):.1f} ms, "
+          f"min {min(times):.1f} ms, max {max(times):.1f} ms over {args.runs} runs")
+
+    eager = samples[-1]["eager"]
+    if eager:
+        print("Heavy subsystems loaded at import time:")
+        for name, modules in eager.items():
+            print(f"  {name}: {', '.join(modules)}")
+        sys.exit(1)
+    print("No heavy subsystems loaded at import time")
+
+if __name__ == "__main__":
+    main()
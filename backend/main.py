@@ -1,30 +1,39 @@
 import os
 import subprocess
-from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body
+from fastapi import FastAPI, UploadFile, File, Form, HTTPException, Body, Request, BackgroundTasks
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse, StreamingResponse, FileResponse
+from fastapi.responses import JSONResponse, StreamingResponse, Response
 import tempfile
 import base64
-import requests
 from dotenv import load_dotenv
 import hashlib
 import json
 from pathlib import Path
 import asyncio
 from typing import List, Optional
-from fpdf import FPDF
-import markdown
 import shutil
-from openai import OpenAI
+import sys
+import importlib
 import time
+from datetime import datetime
 import io
-import textwrap
+import uuid
+import re
+import threading
+import sqlite3
+from contextlib import asynccontextmanager, contextmanager
+from urllib.parse import urlsplit, unquote
+try:
+    import fcntl  # Cross-process scratch quota locking; unavailable on Windows
+except ImportError:
+    fcntl = None
+from collections import Counter
 from concurrent.futures import ThreadPoolExecutor, as_completed
-from PIL import Image
-import numpy as np
 from pydantic import BaseModel
-import yt_dlp
-import cv2
+
+# Heavy dependencies (cv2, numpy, PIL, yt_dlp, fpdf, openai) are imported inside the
+# functions that use them so cold starts only pay for what a request actually needs.
+# See SUBSYSTEMS below for the background warm-up that preloads them after startup.
 
 load_dotenv()  # Load environment variables from .env file
 
@@ -40,11 +49,96 @@ app.add_middleware(
 )
 
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
-CACHE_DIR = Path("cache")
-CACHE_DIR.mkdir(exist_ok=True)
+CACHE_DIR = Path("cache")  # Created on first write by save_to_cache
+REFINE_CACHE_DIR = CACHE_DIR / "refine"
+REFINE_MODEL = "gpt-4o"
+MAX_BATCH_REFINEMENTS = 10
+HISTORY_DB_PATH = Path(os.getenv("HISTORY_DB_PATH", "history.db"))  # Outside CACHE_DIR so clearing the cache keeps history
+HISTORY_PREVIEW_CHARS = 200
+MAX_HISTORY_PAGE_SIZE = 100
+MAX_HISTORY_IMPORT_ENTRIES = 200  # Old clients kept at most 50 entries in localStorage
+# Scratch space for downloads, uploaded videos and extracted frames
+SCRATCH_ROOT = Path(os.getenv("SCRATCH_ROOT", Path(tempfile.gettempdir()) / "frame-insight"))
+SCRATCH_RAM_ROOT = os.getenv("SCRATCH_RAM_ROOT")  # e.g. /dev/shm; used for jobs up to SCRATCH_RAM_MAX_BYTES
+SCRATCH_RAM_MAX_BYTES = int(os.getenv("SCRATCH_RAM_MAX_BYTES", 256 * 1024 * 1024))
+SCRATCH_QUOTA_BYTES = int(os.getenv("SCRATCH_QUOTA_BYTES", 10 * 1024 * 1024 * 1024))
+SCRATCH_WAIT_TIMEOUT = float(os.getenv("SCRATCH_WAIT_TIMEOUT", 600))
+SCRATCH_FRAMES_ESTIMATE = 64 * 1024 * 1024  # Headroom for extracted JPEG frames
+SCRATCH_DOWNLOAD_ESTIMATE = 1024 * 1024 * 1024  # URL downloads have no known size up front
+WATCH_ROOT = os.getenv("WATCH_ROOT")  # Local files may only be watched from inside this directory
+WATCH_STREAM_SCHEMES = {"http", "https", "rtsp", "rtmp", "srt", "udp"}  # Everything else is treated as a local path
+FINGERPRINT_INDEX_PATH = CACHE_DIR / "fingerprints.jsonl"
+# Fraction of frames that must match, in order, to reuse a near-duplicate's result. Unset disables reuse
+FINGERPRINT_SIMILARITY_THRESHOLD = (float(os.environ["FINGERPRINT_SIMILARITY_THRESHOLD"])
+                                    if os.getenv("FINGERPRINT_SIMILARITY_THRESHOLD") else None)
+FINGERPRINT_HASH_SIZE = 16  # Frame hashes and motion maps are 16x16 = 256 bits
+FINGERPRINT_MAX_HAMMING = 10  # Max differing bits for two frame hashes to count as the same frame
+FINGERPRINT_MOTION_DELTA = 12  # Gray-level change that marks a motion map cell as moving
+FINGERPRINT_MAX_MOTION_BITS = 4  # Max differing motion cells for two frames to count as the same
+FINGERPRINT_LENGTH_RATIO = 0.9  # Shorter/longer ratio of frame counts and durations still considered equal
+FINGERPRINT_MAX_OFFSET_FRACTION = 0.1  # Time shift, as a fraction of the frame count, allowed for trims
+WARMUP_ON_STARTUP = os.getenv("WARMUP_ON_STARTUP", "1") != "0"
+
+# Heavy subsystems and the modules each one needs. They load on first use, or in a
+# background warm-up thread once the server is accepting connections.
+SUBSYSTEMS = {
+    "video_decode": ["cv2", "numpy", "PIL.Image"],
+    "downloader": ["yt_dlp"],
+    "pdf_export": ["fpdf"],
+    "model_client": ["openai"],
+}
+subsystem_status = {name: {"load_seconds": None, "error": None} for name in SUBSYSTEMS}
+warmup_state = {"status": "pending" if WARMUP_ON_STARTUP else "disabled", "started_at": None, "finished_at": None}
+
+_client = None
+_client_lock = threading.Lock()
+
+def get_openai_client():
+    """Build the OpenAI client on first use."""
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                from openai import OpenAI
+                _client = OpenAI(api_key=OPENAI_API_KEY)
+    return _client
+
+def is_subsystem_warm(name):
+    if not all(module in sys.modules for module in SUBSYSTEMS[name]):
+        return False
+    if name == "model_client":
+        return _client is not None
+    return True
+
+def load_subsystem(name):
+    """Import every module of a subsystem, recording how long it took."""
+    if is_subsystem_warm(name):
+        return
+    start = time.perf_counter()
+    try:
+        for module in SUBSYSTEMS[name]:
+            importlib.import_module(module)
+        if name == "model_client":
+            get_openai_client()
+        subsystem_status[name]["load_seconds"] = round(time.perf_counter() - start, 3)
+        subsystem_status[name]["error"] = None
+    except Exception as e:
+        subsystem_status[name]["error"] = str(e)
+        print(f"Failed to load subsystem {name}: {e}")
+
+def warm_up_subsystems():
+    warmup_state["status"] = "running"
+    warmup_state["started_at"] = time.time()
+    for name in SUBSYSTEMS:
+        load_subsystem(name)
+    warmup_state["status"] = "done"
+    warmup_state["finished_at"] = time.time()
 
-# Initialize the OpenAI client
-client = OpenAI(api_key=OPENAI_API_KEY)
+@app.on_event("startup")
+async def start_warmup():
+    if WARMUP_ON_STARTUP:
+        # Daemon thread so startup completes, and the server starts accepting, immediately
+        threading.Thread(target=warm_up_subsystems, name="subsystem-warmup", daemon=True).start()
 
 # Analysis Types - All emphasize cohesive, unified analysis
 ANALYSIS_TYPES = {
@@ -87,27 +181,529 @@ class RateLimiter:
 
 rate_limiter = RateLimiter(30)  # 30 requests per minute, adjust as needed
 
-def get_cache_key(file_content, prompt):
-    file_hash = hashlib.md5(file_content).hexdigest()
+async def wait_for_rate_limit(tokens=1, poll_interval=1.0):
+    """Block until the rate limiter grants tokens. For long-running jobs that should queue, not fail."""
+    while not rate_limiter.consume(tokens):
+        await asyncio.sleep(poll_interval)
+
+def cache_key_from_hash(file_hash, prompt):
     prompt_hash = hashlib.md5(prompt.encode()).hexdigest()
     return f"{file_hash}_{prompt_hash}"
 
-def get_cached_result(cache_key):
-    cache_file = CACHE_DIR / f"{cache_key}.json"
+def get_cache_key(file_content, prompt):
+    return cache_key_from_hash(hashlib.md5(file_content).hexdigest(), prompt)
+
+def get_file_hash(file_path, chunk_size=8 * 1024 * 1024):
+    """md5 of a file's bytes, read in chunks so large videos aren't loaded into memory."""
+    file_hash = hashlib.md5()
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            file_hash.update(chunk)
+    return file_hash.hexdigest()
+
+CACHE_KEY_PATTERN = re.compile(r"[0-9a-f]{32}_[0-9a-f]{32}")
+
+def is_valid_cache_key(cache_key):
+    """True for keys in the get_cache_key format; anything else must never reach a cache path."""
+    return bool(CACHE_KEY_PATTERN.fullmatch(cache_key))
+
+def get_cached_result(cache_key, cache_dir=CACHE_DIR):
+    cache_file = cache_dir / f"{cache_key}.json"
     if cache_file.exists():
         with cache_file.open("r") as f:
             return json.load(f)
     return None
 
-def save_to_cache(cache_key, result):
-    cache_file = CACHE_DIR / f"{cache_key}.json"
+def save_to_cache(cache_key, result, cache_dir=CACHE_DIR):
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    cache_file = cache_dir / f"{cache_key}.json"
     with cache_file.open("w") as f:
         json.dump(result, f)
 
-def download_video(url, output_path):
-    """Download and transcode video from URL to ensure compatibility."""
-    # Download to a temporary location first
-    temp_download = output_path + ".temp"
+# Hit/miss counters per cache namespace, reported by /cache_stats
+cache_stats = {
+    "analysis": {"hits": 0, "misses": 0},
+    "refine": {"hits": 0, "misses": 0},
+    "fingerprint": {"hits": 0, "misses": 0},
+}
+
+def record_cache_lookup(namespace, hit):
+    cache_stats[namespace]["hits" if hit else "misses"] += 1
+
+# Cumulative OpenAI token usage for this process
+model_usage = {"requests": 0, "prompt_tokens": 0, "completion_tokens": 0}
+
+def record_model_usage(response):
+    model_usage["requests"] += 1
+    usage = getattr(response, "usage", None)
+    if usage:
+        model_usage["prompt_tokens"] += usage.prompt_tokens or 0
+        model_usage["completion_tokens"] += usage.completion_tokens or 0
+
+# History store: one row per completed analysis. Listing returns lightweight summary
+# rows; the full result and refinements are only read by get_history_entry.
+HISTORY_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    created_at REAL NOT NULL,
+    source TEXT NOT NULL,
+    source_type TEXT NOT NULL,
+    analysis_type TEXT NOT NULL,
+    custom_prompt TEXT NOT NULL DEFAULT '',
+    cache_key TEXT NOT NULL,
+    frames_extracted INTEGER,
+    preview TEXT NOT NULL DEFAULT '',
+    refinement_count INTEGER NOT NULL DEFAULT 0,
+    result TEXT NOT NULL,
+    refinements TEXT NOT NULL DEFAULT '[]'
+);
+-- Listing pages on (created_at, id): imported entries keep their original time
+DROP INDEX IF EXISTS history_created_at;
+DROP INDEX IF EXISTS history_source;
+DROP INDEX IF EXISTS history_analysis_type;
+CREATE INDEX IF NOT EXISTS history_created_at_id ON history (created_at, id);
+CREATE INDEX IF NOT EXISTS history_source_created_at ON history (source, created_at, id);
+CREATE INDEX IF NOT EXISTS history_analysis_type_created_at ON history (analysis_type, created_at, id);
+CREATE INDEX IF NOT EXISTS history_cache_key ON history (cache_key);
+"""
+HISTORY_FTS_SCHEMA = """
+CREATE VIRTUAL TABLE IF NOT EXISTS history_fts USING fts5(source, analysis, refinements);
+"""
+HISTORY_SUMMARY_COLUMNS = "h.id, h.created_at, h.source, h.source_type, h.analysis_type, h.cache_key, h.frames_extracted, h.preview, h.refinement_count"
+
+history_fts_enabled = None  # Resolved when the database is first opened; False if SQLite lacks FTS5
+history_init_lock = threading.Lock()
+
+def get_history_db():
+    """Open a connection to the history database, creating the schema on first use."""
+    global history_fts_enabled
+    conn = sqlite3.connect(HISTORY_DB_PATH, timeout=10)
+    conn.row_factory = sqlite3.Row
+    if history_fts_enabled is None:
+        with history_init_lock:
+            if history_fts_enabled is None:
+                conn.executescript(HISTORY_SCHEMA)
+                try:
+                    conn.executescript(HISTORY_FTS_SCHEMA)
+                    history_fts_enabled = True
+                except sqlite3.OperationalError:
+                    print("SQLite FTS5 unavailable, history search falls back to LIKE")
+                    history_fts_enabled = False
+    return conn
+
+def analysis_text(result):
+    """Plain text of a result's analysis, including every chunk of a chunked result."""
+    if "chunks" in result:
+        return "\n\n".join(analysis_text(chunk) for chunk in result["chunks"])
+    analysis = result.get("analysis", "")
+    return analysis if isinstance(analysis, str) else json.dumps(analysis)
+
+def refinements_text(refinements):
+    return "\n\n".join(str(r.get("analysis", "")) for r in refinements if isinstance(r, dict))
+
+def insert_history(conn, result, cache_key, source, source_type, custom_prompt="", refinements=None,
+                   created_at=None):
+    text = analysis_text(result)
+    refinements = refinements or []
+    cursor = conn.execute(
+        "INSERT INTO history (created_at, source, source_type, analysis_type, custom_prompt, cache_key, "
+        "frames_extracted, preview, refinement_count, result, refinements) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+        (created_at or time.time(), source, source_type, result.get("analysis_type", ""), custom_prompt, cache_key,
+         result.get("frames_extracted"), text[:HISTORY_PREVIEW_CHARS], len(refinements), json.dumps(result),
+         json.dumps(refinements))
+    )
+    history_id = cursor.lastrowid
+    if history_fts_enabled:
+        conn.execute("INSERT INTO history_fts (rowid, source, analysis, refinements) VALUES (?, ?, ?, ?)",
+                     (history_id, source, text, refinements_text(refinements)))
+    return history_id
+
+def record_history(result, cache_key, source, source_type, custom_prompt=""):
+    """Add a completed analysis to the history store and return its id."""
+    conn = get_history_db()
+    try:
+        with conn:
+            return insert_history(conn, result, cache_key, source, source_type, custom_prompt)
+    finally:
+        conn.close()
+
+def parse_legacy_timestamp(value):
+    # The old client stored Date.toISOString(), whose trailing Z fromisoformat() rejects before 3.11
+    try:
+        return datetime.fromisoformat(str(value).replace("Z", "+00:00")).timestamp()
+    except ValueError:
+        return None
+
+def import_legacy_history(entries):
+    """Store history entries saved by the old browser-only client, oldest first, in one transaction.
+
+    Returns the number of entries imported; entries without a result object are skipped.
+    """
+    rows = []
+    for entry in entries:
+        result = entry.get("result")
+        if not isinstance(result, dict):
+            continue
+        source = str(entry.get("filename") or "Unknown")
+        if not result.get("analysis_type") and entry.get("analysisType"):
+            result = {**result, "analysis_type": entry["analysisType"]}
+        refinements = entry.get("refinements")
+        rows.append((parse_legacy_timestamp(entry.get("timestamp")) or time.time(), result, source,
+                     str(entry.get("customPrompt") or ""), refinements if isinstance(refinements, list) else []))
+    rows.sort(key=lambda row: row[0])
+
+    conn = get_history_db()
+    try:
+        with conn:
+            for created_at, result, source, custom_prompt, refinements in rows:
+                cache_key = result.get("cache_key") if is_valid_cache_key(result.get("cache_key") or "") else ""
+                insert_history(conn, result, cache_key, source, "url" if "://" in source else "file",
+                               custom_prompt, refinements, created_at)
+        return len(rows)
+    finally:
+        conn.close()
+
+def fts_query(text):
+    # Quote every term so user input can't produce FTS syntax errors; terms are ANDed
+    return " ".join('"' + term.replace('"', '""') + '"' for term in text.split())
+
+def encode_history_cursor(row):
+    # repr() round-trips the float exactly, so the next page starts right after this row
+    return f"{row['created_at']!r}_{row['id']}"
+
+def decode_history_cursor(cursor):
+    """(created_at, id) from a cursor returned by list_history. Raises ValueError if malformed."""
+    created_at, _, history_id = cursor.partition("_")
+    return float(created_at), int(history_id)
+
+def list_history(limit=20, cursor=None, analysis_type=None, source=None, cache_key=None,
+                 since=None, until=None, query=None):
+    """Page through summary rows, newest first. Returns (rows, total, next_cursor).
+
+    Rows are ordered by (created_at, id) so imported entries sit at their original time;
+    cursor is a (created_at, id) tuple from decode_history_cursor.
+    """
+    conditions, params = [], []
+    if analysis_type:
+        conditions.append("h.analysis_type = ?")
+        params.append(analysis_type)
+    if source:
+        conditions.append("h.source = ?")
+        params.append(source)
+    if cache_key:
+        conditions.append("h.cache_key = ?")
+        params.append(cache_key)
+    if since is not None:
+        conditions.append("h.created_at >= ?")
+        params.append(since)
+    if until is not None:
+        conditions.append("h.created_at < ?")
+        params.append(until)
+
+    conn = get_history_db()
+    try:
+        if query and query.strip():
+            if history_fts_enabled:
+                conditions.append("h.id IN (SELECT rowid FROM history_fts WHERE history_fts MATCH ?)")
+                params.append(fts_query(query))
+            else:
+                conditions.append("(h.source LIKE ? OR h.result LIKE ? OR h.refinements LIKE ?)")
+                params.extend([f"%{query.strip()}%"] * 3)
+
+        # The total ignores the page cursor so the UI can show an overall count
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        total = conn.execute(f"SELECT COUNT(*) FROM history h {where}", params).fetchone()[0]
+
+        # Keyset pagination on (created_at, id): stable while new entries are added, no OFFSET scans.
+        # id breaks ties between entries recorded at the same time
+        if cursor is not None:
+            conditions.append("(h.created_at, h.id) < (?, ?)")
+            params.extend(cursor)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        rows = conn.execute(
+            f"SELECT {HISTORY_SUMMARY_COLUMNS} FROM history h {where} ORDER BY h.created_at DESC, h.id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+    finally:
+        conn.close()
+
+    items = [dict(row) for row in rows[:limit]]
+    next_cursor = encode_history_cursor(items[-1]) if len(rows) > limit else None
+    return items, total, next_cursor
+
+def get_history_entry(history_id):
+    conn = get_history_db()
+    try:
+        row = conn.execute("SELECT * FROM history WHERE id = ?", (history_id,)).fetchone()
+    finally:
+        conn.close()
+    if row is None:
+        return None
+    entry = dict(row)
+    entry["result"] = json.loads(entry["result"])
+    entry["refinements"] = json.loads(entry["refinements"])
+    return entry
+
+def update_history_refinements(history_id, refinements):
+    conn = get_history_db()
+    try:
+        with conn:
+            updated = conn.execute("UPDATE history SET refinements = ?, refinement_count = ? WHERE id = ?",
+                                   (json.dumps(refinements), len(refinements), history_id)).rowcount
+            if updated and history_fts_enabled:
+                conn.execute("UPDATE history_fts SET refinements = ? WHERE rowid = ?",
+                             (refinements_text(refinements), history_id))
+        return bool(updated)
+    finally:
+        conn.close()
+
+def delete_history(history_id=None):
+    """Delete one entry, or every entry when history_id is None. Returns the number deleted."""
+    conn = get_history_db()
+    try:
+        with conn:
+            if history_id is None:
+                deleted = conn.execute("DELETE FROM history").rowcount
+                if history_fts_enabled:
+                    conn.execute("DELETE FROM history_fts")
+            else:
+                deleted = conn.execute("DELETE FROM history WHERE id = ?", (history_id,)).rowcount
+                if history_fts_enabled:
+                    conn.execute("DELETE FROM history_fts WHERE rowid = ?", (history_id,))
+        return deleted
+    finally:
+        conn.close()
+
+class Workspace:
+    """Scratch directory owned by one job. Everything a job writes goes under `root`."""
+
+    def __init__(self, root, reserved_bytes):
+        self.root = root
+        self.reserved_bytes = reserved_bytes
+
+    def path(self, name):
+        return str(self.root / name)
+
+    def mkdir(self, name):
+        path = self.root / name
+        path.mkdir(parents=True, exist_ok=True)
+        return str(path)
+
+    def disk_usage(self):
+        return directory_size(self.root)
+
+def directory_size(path):
+    total = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            try:
+                total += os.path.getsize(os.path.join(dirpath, name))
+            except OSError:
+                pass  # Removed while walking
+    return total
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True  # Exists but belongs to another user
+    return True
+
+class WorkspaceManager:
+    """Hands out per-job scratch directories under a global byte quota.
+
+    Jobs reserve their expected size up front and wait while the quota (or the
+    free space of the target filesystem) can't fit them. Small jobs go to the
+    RAM-backed root when one is configured. Each job directory records its owner
+    pid and reservation in an owner file. Reservations are summed from those files
+    under a file lock, so the quota is shared by every process using the same
+    SCRATCH_ROOT (uvicorn workers, batch.py). Directories left behind by a crashed
+    worker are removed by sweep_orphans.
+    """
+    OWNER_FILE = ".owner.json"
+    LOCK_FILE = ".quota.lock"
+
+    def __init__(self, root, ram_root=None, ram_max_bytes=0, quota_bytes=SCRATCH_QUOTA_BYTES,
+                 wait_timeout=SCRATCH_WAIT_TIMEOUT):
+        self.root = Path(root)
+        self.ram_root = Path(ram_root) / "frame-insight" if ram_root else None
+        self.ram_max_bytes = ram_max_bytes
+        self.quota_bytes = quota_bytes
+        self.wait_timeout = wait_timeout
+        self.started_at = time.time()
+        self.lock = threading.Lock()
+        self.active = {}  # job dir -> Workspace, for this process only
+        self.waiting = 0
+        self.stats_counters = {"jobs_started": 0, "jobs_waited": 0, "wait_seconds": 0.0,
+                               "orphans_removed": 0, "orphan_bytes_removed": 0}
+
+    def roots(self):
+        return [root for root in (self.root, self.ram_root) if root is not None]
+
+    def _pick_root(self, expected_bytes):
+        if self.ram_root and expected_bytes <= self.ram_max_bytes:
+            return self.ram_root
+        return self.root
+
+    @contextmanager
+    def _quota_lock(self):
+        """Serialize reservations within this process and, where fcntl exists, across processes."""
+        with self.lock:
+            self.root.mkdir(parents=True, exist_ok=True)
+            with (self.root / self.LOCK_FILE).open("a") as lock_file:
+                if fcntl:
+                    fcntl.flock(lock_file, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    if fcntl:
+                        fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _read_owner(self, job_dir):
+        try:
+            with (job_dir / self.OWNER_FILE).open("r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _owner_alive(self, owner):
+        try:
+            # The same pid in this process after a restart is a dead predecessor
+            return pid_alive(owner["pid"]) and not (
+                owner["pid"] == os.getpid() and owner["created_at"] < self.started_at)
+        except (KeyError, TypeError):
+            return False
+
+    def _live_reservations(self):
+        """(total reserved bytes, job count) over every live job in all processes."""
+        total, jobs = 0, 0
+        for root in self.roots():
+            if not root.exists():
+                continue
+            for job_dir in root.glob("job-*"):
+                owner = self._read_owner(job_dir)
+                if owner and self._owner_alive(owner):
+                    total += owner.get("reserved_bytes", 0)
+                    jobs += 1
+        return total, jobs
+
+    def _try_reserve(self, root, expected_bytes):
+        with self._quota_lock():
+            reserved, jobs = self._live_reservations()
+            # A job bigger than the whole quota may still run, but only on its own
+            if jobs and reserved + expected_bytes > self.quota_bytes:
+                return None
+            root.mkdir(parents=True, exist_ok=True)
+            if jobs and shutil.disk_usage(root).free < expected_bytes:
+                return None
+            job_dir = root / f"job-{os.getpid()}-{uuid.uuid4().hex[:12]}"
+            job_dir.mkdir()
+            with (job_dir / self.OWNER_FILE).open("w") as f:
+                json.dump({"pid": os.getpid(), "created_at": time.time(), "reserved_bytes": expected_bytes}, f)
+            workspace = Workspace(job_dir, expected_bytes)
+            self.active[job_dir] = workspace
+            self.stats_counters["jobs_started"] += 1
+            return workspace
+
+    async def acquire(self, expected_bytes):
+        expected_bytes = min(expected_bytes, self.quota_bytes)
+        root = self._pick_root(expected_bytes)
+        workspace = self._try_reserve(root, expected_bytes)
+        if workspace:
+            return workspace
+
+        # Out of space: poll until running jobs, in any process, release theirs
+        started = time.monotonic()
+        with self.lock:
+            self.waiting += 1
+        try:
+            while workspace is None:
+                if time.monotonic() - started > self.wait_timeout:
+                    raise Exception("Timed out waiting for scratch disk space. Try again later.")
+                await asyncio.sleep(0.5)
+                workspace = self._try_reserve(root, expected_bytes)
+        finally:
+            with self.lock:
+                self.waiting -= 1
+                self.stats_counters["jobs_waited"] += 1
+                self.stats_counters["wait_seconds"] += time.monotonic() - started
+        return workspace
+
+    def release(self, workspace):
+        # Removing the directory removes its owner file, which frees the reservation
+        shutil.rmtree(workspace.root, ignore_errors=True)
+        with self.lock:
+            self.active.pop(workspace.root, None)
+
+    @asynccontextmanager
+    async def job(self, expected_bytes):
+        workspace = await self.acquire(expected_bytes)
+        try:
+            yield workspace
+        finally:
+            self.release(workspace)
+
+    def sweep_orphans(self):
+        """Remove job directories whose owning process is gone."""
+        for root in self.roots():
+            if not root.exists():
+                continue
+            for job_dir in root.glob("job-*"):
+                if job_dir in self.active:
+                    continue
+                owner = self._read_owner(job_dir)
+                if owner is not None:
+                    orphaned = not self._owner_alive(owner)
+                else:
+                    # No readable owner file: only remove it once it's clearly stale
+                    try:
+                        orphaned = time.time() - job_dir.stat().st_mtime > 3600
+                    except OSError:
+                        continue  # Released while we were looking
+                if orphaned:
+                    size = directory_size(job_dir)
+                    shutil.rmtree(job_dir, ignore_errors=True)
+                    self.stats_counters["orphans_removed"] += 1
+                    self.stats_counters["orphan_bytes_removed"] += size
+                    print(f"Removed orphaned scratch directory {job_dir} ({size} bytes)")
+
+    def stats(self):
+        with self.lock:
+            active = list(self.active.values())
+            waiting = self.waiting
+        reserved, jobs = self._live_reservations()
+        roots = {}
+        for root in self.roots():
+            entry = {"path": str(root), "used_bytes": directory_size(root) if root.exists() else 0}
+            if root.exists():
+                disk = shutil.disk_usage(root)
+                entry.update({"disk_total_bytes": disk.total, "disk_free_bytes": disk.free})
+            roots["ram" if root == self.ram_root else "disk"] = entry
+        return {
+            "quota_bytes": self.quota_bytes,
+            "reserved_bytes": reserved,  # Across all processes sharing the scratch roots
+            "active_jobs": jobs,
+            "process_active_jobs": len(active),
+            "process_waiting_jobs": waiting,
+            "process_active_job_bytes": sum(ws.disk_usage() for ws in active),
+            "roots": roots,
+            **self.stats_counters,
+        }
+
+workspace_manager = WorkspaceManager(SCRATCH_ROOT, SCRATCH_RAM_ROOT, SCRATCH_RAM_MAX_BYTES)
+
+@app.on_event("startup")
+async def sweep_scratch():
+    # Off the startup path: a large leftover tree shouldn't delay accepting connections
+    threading.Thread(target=workspace_manager.sweep_orphans, name="scratch-sweep", daemon=True).start()
+
+def download_video(url, workspace):
+    """Download and transcode video from URL to ensure compatibility. Returns the path of the video."""
+    output_path = workspace.path("video.mp4")
+    # Download to a temporary location first; the job workspace is removed on failure
+    temp_download = workspace.path("download.temp")
     
     # Try multiple client strategies for YouTube
     ydl_opts = {
@@ -146,143 +742,155 @@ def download_video(url, output_path):
         'retries': 5,
     }
     
+    import yt_dlp
+
+    # Strategy 1: Try with iOS client (most reliable for YouTube)
+    success = False
+    last_error = None
+    
     try:
-        # Strategy 1: Try with iOS client (most reliable for YouTube)
-        success = False
-        last_error = None
-        
+        print("Attempting download with iOS client...")
+        with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+            ydl.download([url])
+        success = True
+    except Exception as e:
+        last_error = e
+        print(f"iOS client failed: {e}")
+    
+    # Strategy 2: Try with Android client
+    if not success:
         try:
-            print("Attempting download with iOS client...")
+            print("Retrying with Android client...")
+            ydl_opts['extractor_args']['youtube']['player_client'] = ['android']
+            ydl_opts['http_headers']['User-Agent'] = 'com.google.android.youtube/19.29.37 (Linux; U; Android 13)'
             with yt_dlp.YoutubeDL(ydl_opts) as ydl:
                 ydl.download([url])
             success = True
         except Exception as e:
             last_error = e
-            print(f"iOS client failed: {e}")
-        
-        # Strategy 2: Try with Android client
-        if not success:
-            try:
-                print("Retrying with Android client...")
-                ydl_opts['extractor_args']['youtube']['player_client'] = ['android']
-                ydl_opts['http_headers']['User-Agent'] = 'com.google.android.youtube/19.29.37 (Linux; U; Android 13)'
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-                success = True
-            except Exception as e:
-                last_error = e
-                print(f"Android client failed: {e}")
-        
-        # Strategy 3: Try web client with different user agent
-        if not success:
-            try:
-                print("Retrying with web client...")
-                ydl_opts['extractor_args']['youtube']['player_client'] = ['web']
-                ydl_opts['http_headers']['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
-                ydl_opts['format'] = 'best[height<=480]/worst'  # Try even lower quality
-                with yt_dlp.YoutubeDL(ydl_opts) as ydl:
-                    ydl.download([url])
-                success = True
-            except Exception as e:
-                last_error = e
-                print(f"Web client failed: {e}")
-        
-        # Strategy 4: Last resort - try with minimal options
-        if not success:
-            try:
-                print("Final attempt with minimal config...")
-                minimal_opts = {
-                    'format': 'worst',
-                    'outtmpl': temp_download,
-                    'quiet': True,
-                }
-                with yt_dlp.YoutubeDL(minimal_opts) as ydl:
-                    ydl.download([url])
-                success = True
-            except Exception as e:
-                last_error = e
-                print(f"Minimal config failed: {e}")
-        
-        if not success:
-            error_msg = str(last_error)
-            if '403' in error_msg or 'Forbidden' in error_msg:
-                raise Exception(
-                    "Unable to download video (Access Denied). Please use the 'Upload File' option instead. "
-                    "Download the video manually first, then upload it here for analysis."
-                )
-            elif 'player response' in error_msg.lower():
-                raise Exception(
-                    "YouTube download temporarily unavailable. Please: 1) Try a different video, or "
-                    "2) Download the video manually and use 'Upload File' instead."
-                )
-            else:
-                raise Exception(f"Download failed: {error_msg}")
-        
-        # Check if file exists (yt-dlp might add .mp4 extension)
-        actual_file = temp_download
-        possible_files = [
-            temp_download,
-            temp_download + ".mp4",
-            temp_download + ".webm",
-            temp_download + ".mkv"
-        ]
-        
-        for pf in possible_files:
-            if os.path.exists(pf):
-                actual_file = pf
-                break
-        
-        if not os.path.exists(actual_file):
-            raise Exception("Download completed but output file not found")
-        
-        print(f"Downloaded to: {actual_file}")
-        
-        # Transcode to ensure compatibility with ffmpeg
-        ffmpeg_command = shutil.which('ffmpeg') or 'ffmpeg'
-        transcode_cmd = [
-            ffmpeg_command,
-            '-i', actual_file,
-            '-c:v', 'libx264',  # Re-encode video
-            '-preset', 'ultrafast',  # Fast encoding
-            '-c:a', 'aac',  # Re-encode audio
-            '-strict', 'experimental',
-            '-y',  # Overwrite output
-            output_path
-        ]
-        
-        print("Transcoding video...")
-        result = subprocess.run(transcode_cmd, capture_output=True, text=True)
-        
-        # Clean up temp file
-        if os.path.exists(actual_file):
-            os.remove(actual_file)
-        
-        if result.returncode != 0:
-            raise Exception(f"Transcoding failed: {result.stderr}")
-        
-        print("Video ready for processing")
+            print(f"Android client failed: {e}")
+    
+    # Strategy 3: Try web client with different user agent
+    if not success:
+        try:
+            print("Retrying with web client...")
+            ydl_opts['extractor_args']['youtube']['player_client'] = ['web']
+            ydl_opts['http_headers']['User-Agent'] = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
+            ydl_opts['format'] = 'best[height<=480]/worst'  # Try even lower quality
+            with yt_dlp.YoutubeDL(ydl_opts) as ydl:
+                ydl.download([url])
+            success = True
+        except Exception as e:
+            last_error = e
+            print(f"Web client failed: {e}")
+    
+    # Strategy 4: Last resort - try with minimal options
+    if not success:
+        try:
+            print("Final attempt with minimal config...")
+            minimal_opts = {
+                'format': 'worst',
+                'outtmpl': temp_download,
+                'quiet': True,
+            }
+            with yt_dlp.YoutubeDL(minimal_opts) as ydl:
+                ydl.download([url])
+            success = True
+        except Exception as e:
+            last_error = e
+            print(f"Minimal config failed: {e}")
+    
+    if not success:
+        error_msg = str(last_error)
+        if '403' in error_msg or 'Forbidden' in error_msg:
+            raise Exception(
+                "Unable to download video (Access Denied). Please use the 'Upload File' option instead. "
+                "Download the video manually first, then upload it here for analysis."
+            )
+        elif 'player response' in error_msg.lower():
+            raise Exception(
+                "YouTube download temporarily unavailable. Please: 1) Try a different video, or "
+                "2) Download the video manually and use 'Upload File' instead."
+            )
+        else:
+            raise Exception(f"Download failed: {error_msg}")
+    
+    # Check if file exists (yt-dlp might add .mp4 extension)
+    actual_file = temp_download
+    possible_files = [
+        temp_download,
+        temp_download + ".mp4",
+        temp_download + ".webm",
+        temp_download + ".mkv"
+    ]
+    
+    for pf in possible_files:
+        if os.path.exists(pf):
+            actual_file = pf
+            break
+    
+    if not os.path.exists(actual_file):
+        raise Exception("Download completed but output file not found")
+    
+    print(f"Downloaded to: {actual_file}")
+    
+    # Transcode to ensure compatibility with ffmpeg
+    ffmpeg_command = shutil.which('ffmpeg') or 'ffmpeg'
+    transcode_cmd = [
+        ffmpeg_command,
+        '-i', actual_file,
+        '-c:v', 'libx264',  # Re-encode video
+        '-preset', 'ultrafast',  # Fast encoding
+        '-c:a', 'aac',  # Re-encode audio
+        '-strict', 'experimental',
+        '-y',  # Overwrite output
+        output_path
+    ]
+    
+    print("Transcoding video...")
+    result = subprocess.run(transcode_cmd, capture_output=True, text=True)
+    
+    # Free the raw download now so it doesn't count against the scratch quota while we analyze
+    if os.path.exists(actual_file):
+        os.remove(actual_file)
+    
+    if result.returncode != 0:
+        raise Exception(f"Transcoding failed: {result.stderr}")
+    
+    print("Video ready for processing")
+    return output_path
+
+class SceneDetector:
+    """Frame-difference scene change detection that keeps its state between calls."""
+
+    def __init__(self, threshold=30.0):
+        self.threshold = threshold
+        self.prev_frame = None
+
+    def is_scene_change(self, frame):
+        import cv2
+        import numpy as np
+
+        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
+        changed = False
+        if self.prev_frame is not None:
+            # Calculate frame difference
+            diff = cv2.absdiff(self.prev_frame, gray)
+            mean_diff = np.mean(diff)
             
-    except Exception as e:
-        # Clean up on failure
-        cleanup_files = [temp_download, temp_download + ".mp4", temp_download + ".webm", temp_download + ".mkv"]
-        if 'actual_file' in locals():
-            cleanup_files.append(actual_file)
-        
-        for f in cleanup_files:
-            if f and os.path.exists(f):
-                try:
-                    os.remove(f)
-                except:
-                    pass
+            # If significant change detected, mark as scene change
+            changed = mean_diff > self.threshold
         
-        # Re-raise with preserved message
-        raise e
+        self.prev_frame = gray
+        return changed
 
 def detect_scene_changes(video_path, threshold=30.0):
     """Detect scene changes in a video using frame difference."""
+    import cv2
+
     cap = cv2.VideoCapture(video_path)
     scene_frames = [0]  # Always include first frame
-    prev_frame = None
+    detector = SceneDetector(threshold)
     frame_count = 0
     
     while True:
@@ -290,18 +898,9 @@ def detect_scene_changes(video_path, threshold=30.0):
         if not ret:
             break
         
-        gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
-        
-        if prev_frame is not None:
-            # Calculate frame difference
-            diff = cv2.absdiff(prev_frame, gray)
-            mean_diff = np.mean(diff)
-            
-            # If significant change detected, mark as scene change
-            if mean_diff > threshold:
-                scene_frames.append(frame_count)
+        if detector.is_scene_change(frame):
+            scene_frames.append(frame_count)
         
-        prev_frame = gray
         frame_count += 1
     
     cap.release()
@@ -309,6 +908,8 @@ def detect_scene_changes(video_path, threshold=30.0):
 
 def extract_frames_smart(video_path, output_folder, max_frames=30):
     """Smart frame extraction using scene change detection + time-based sampling."""
+    import cv2
+
     os.makedirs(output_folder, exist_ok=True)
     
     # Validate video file exists
@@ -416,7 +1017,240 @@ def extract_frames_smart(video_path, output_folder, max_frames=30):
     
     return frames
 
+def video_duration(video_path):
+    """Duration in seconds from the container metadata, or None if unknown."""
+    import cv2
+
+    cap = cv2.VideoCapture(video_path)
+    try:
+        fps = cap.get(cv2.CAP_PROP_FPS)
+        total_frames = cap.get(cv2.CAP_PROP_FRAME_COUNT)
+    finally:
+        cap.release()
+    return total_frames / fps if fps > 0 and total_frames > 0 else None
+
+def frame_dhash(gray):
+    """256-bit difference hash of a grayscale frame: one bit per horizontal gradient of a 17x16 thumbnail."""
+    import cv2
+    import numpy as np
+
+    size = FINGERPRINT_HASH_SIZE
+    small = cv2.resize(gray, (size + 1, size), interpolation=cv2.INTER_AREA)
+    bits = small[:, 1:] > small[:, :-1]
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+def compute_fingerprint(frames, duration=None):
+    """Perceptual fingerprint of a video, in frame order.
+
+    "hashes" holds the dHash of each frame; "motion" holds a 16x16 map of the cells
+    that changed since the previous frame (None for the first), so clips of the same
+    static scene only match if the same things move in them.
+    """
+    import cv2
+    import numpy as np
+
+    size = FINGERPRINT_HASH_SIZE
+    hashes, motion = [], []
+    previous = None
+    for frame in frames:
+        # JPEG decoding at reduced scale is much cheaper and plenty for a 17x16 thumbnail
+        gray = cv2.imread(frame, cv2.IMREAD_REDUCED_GRAYSCALE_4)
+        if gray is None:
+            continue
+        hashes.append(frame_dhash(gray))
+        thumbnail = cv2.resize(gray, (size, size), interpolation=cv2.INTER_AREA).astype(np.int16)
+        if previous is None:
+            motion.append(None)
+        else:
+            moving = np.abs(thumbnail - previous) > FINGERPRINT_MOTION_DELTA
+            motion.append(int.from_bytes(np.packbits(moving).tobytes(), "big"))
+        previous = thumbnail
+    return {"hashes": hashes, "motion": motion, "duration": duration}
+
+def fingerprint_similarity(fingerprint_a, fingerprint_b, max_distance=FINGERPRINT_MAX_HAMMING,
+                           max_motion=FINGERPRINT_MAX_MOTION_BITS, threshold=0.0):
+    """Fraction of frames that match in order at the best time offset, or 0.0 if the clips differ in length.
+
+    Frames are compared pairwise after shifting one sequence by up to
+    FINGERPRINT_MAX_OFFSET_FRACTION of its length, which absorbs trimmed starts.
+    A pair matches when both the frame hash and the motion map are close. Offsets
+    that can no longer reach `threshold` are abandoned early (and score below it).
+    """
+    hashes_a, hashes_b = fingerprint_a["hashes"], fingerprint_b["hashes"]
+    motion_a, motion_b = fingerprint_a["motion"], fingerprint_b["motion"]
+    n, m = len(hashes_a), len(hashes_b)
+    if not n or not m or min(n, m) / max(n, m) < FINGERPRINT_LENGTH_RATIO:
+        return 0.0
+    duration_a, duration_b = fingerprint_a.get("duration"), fingerprint_b.get("duration")
+    if duration_a and duration_b and min(duration_a, duration_b) / max(duration_a, duration_b) < FINGERPRINT_LENGTH_RATIO:
+        return 0.0
+
+    max_offset = max(1, int(max(n, m) * FINGERPRINT_MAX_OFFSET_FRACTION))
+    needed = threshold * max(n, m)
+    best = 0
+    for offset in range(-max_offset, max_offset + 1):
+        pairs = range(max(0, -offset), min(n, m - offset))
+        if len(pairs) < max(needed, best + 1):
+            continue
+        # Stop once so many pairs missed that this offset can't reach the threshold
+        allowed_misses = len(pairs) - needed
+        matched = misses = 0
+        for i in pairs:
+            j = i + offset
+            # The first frame of either clip has no previous frame to compare motion against
+            if bin(hashes_a[i] ^ hashes_b[j]).count("1") > max_distance or (
+                    motion_a[i] is not None and motion_b[j] is not None
+                    and bin(motion_a[i] ^ motion_b[j]).count("1") > max_motion):
+                misses += 1
+                if misses > allowed_misses:
+                    break
+            else:
+                matched += 1
+        best = max(best, matched)
+    return best / max(n, m)
+
+class FingerprintIndex:
+    """Append-only index of video fingerprints with banded lookup for near-duplicates.
+
+    Each 256-bit frame hash is split into 16 bands of 16 bits. Two hashes within
+    FINGERPRINT_MAX_HAMMING (< 16) bits share at least one band exactly, so
+    candidates come from exact band buckets and are verified afterwards.
+    """
+    BANDS = 16
+    BAND_BITS = 16
+
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}  # cache_key -> {"analysis_key", "fingerprint"}
+        self.buckets = {}  # (band, value) -> set of cache keys
+        self.loaded = False
+        self.lock = threading.Lock()
+
+    def _bands(self, value):
+        mask = (1 << self.BAND_BITS) - 1
+        return [(band, (value >> (band * self.BAND_BITS)) & mask) for band in range(self.BANDS)]
+
+    def _insert(self, cache_key, analysis_key, fingerprint):
+        self.entries[cache_key] = {"analysis_key": analysis_key, "fingerprint": fingerprint}
+        for value in fingerprint["hashes"]:
+            for bucket in self._bands(value):
+                self.buckets.setdefault(bucket, set()).add(cache_key)
+
+    def _load(self):
+        if self.loaded:
+            return
+        if self.path.exists():
+            with self.path.open("r") as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                        fingerprint = {
+                            "hashes": [int(h, 16) for h in entry["hashes"]],
+                            "motion": [int(h, 16) if h is not None else None for h in entry["motion"]],
+                            "duration": entry.get("duration"),
+                        }
+                        self._insert(entry["cache_key"], entry["analysis_key"], fingerprint)
+                    except (ValueError, KeyError, TypeError):
+                        continue  # Skip a line torn by a crash mid-write, or from the old hash format
+        self.loaded = True
+
+    def add(self, cache_key, analysis_key, fingerprint):
+        if not fingerprint["hashes"]:
+            return
+        with self.lock:
+            self._load()
+            self._insert(cache_key, analysis_key, fingerprint)
+            self.path.parent.mkdir(parents=True, exist_ok=True)
+            with self.path.open("a") as f:
+                f.write(json.dumps({
+                    "cache_key": cache_key,
+                    "analysis_key": analysis_key,
+                    "duration": fingerprint["duration"],
+                    "hashes": [f"{h:064x}" for h in fingerprint["hashes"]],
+                    "motion": [f"{h:064x}" if h is not None else None for h in fingerprint["motion"]],
+                }) + "\n")
+
+    def lookup(self, fingerprint, analysis_key, threshold, exclude=None):
+        """Return (cache_key, similarity) of the closest indexed video above threshold, or None."""
+        hashes = fingerprint["hashes"]
+        if not hashes:
+            return None
+        with self.lock:
+            self._load()
+            votes = Counter()
+            for value in hashes:
+                votes.update(set().union(*(self.buckets.get(bucket, ()) for bucket in self._bands(value))))
+
+            best = None
+            for cache_key, count in votes.items():
+                entry = self.entries[cache_key]
+                if cache_key == exclude or entry["analysis_key"] != analysis_key:
+                    continue
+                # A candidate can only reach the threshold if enough query frames hit its buckets
+                if count / len(hashes) < threshold:
+                    continue
+                similarity = fingerprint_similarity(fingerprint, entry["fingerprint"], threshold=threshold)
+                if similarity >= threshold and (best is None or similarity > best[1]):
+                    best = (cache_key, similarity)
+            return best
+
+    def __len__(self):
+        with self.lock:
+            self._load()
+            return len(self.entries)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.buckets.clear()
+            self.loaded = False
+
+fingerprint_index = FingerprintIndex(FINGERPRINT_INDEX_PATH)
+
+def find_fingerprint_match(extracted_frames, cache_key, video_path=None):
+    """Look up a near-duplicate video analyzed with the same prompt. Blocking; run it in an executor.
+
+    Returns (fingerprint, match) where match is (cached_result, matched_key, similarity) or None.
+    """
+    fingerprint = compute_fingerprint(extracted_frames, video_duration(video_path) if video_path else None)
+    # Cache keys are "<video hash>_<prompt hash>"; only reuse results produced by the same prompt
+    analysis_key = cache_key.split("_", 1)[1]
+    match = fingerprint_index.lookup(fingerprint, analysis_key, FINGERPRINT_SIMILARITY_THRESHOLD, exclude=cache_key)
+    if match:
+        matched_key, similarity = match
+        cached_result = get_cached_result(matched_key)
+        # The index can outlive a cleared cache entry; treat that as a miss
+        if cached_result and isinstance(cached_result.get("analysis"), str):
+            record_cache_lookup("fingerprint", True)
+            return fingerprint, (cached_result, matched_key, similarity)
+    record_cache_lookup("fingerprint", False)
+    return fingerprint, None
+
+async def analyze_frames(extracted_frames, analysis_type, custom_prompt="", cache_key=None, video_path=None):
+    """Run the model on extracted frames.
+
+    When FINGERPRINT_SIMILARITY_THRESHOLD is set and cache_key is given, a near-duplicate's
+    analysis is reused instead. video_path lets the match also compare durations.
+    """
+    if cache_key is None or FINGERPRINT_SIMILARITY_THRESHOLD is None:
+        return await process_frames(extracted_frames, analysis_type, custom_prompt), None
+
+    # Decoding frames and scanning the index would otherwise block the event loop
+    loop = asyncio.get_event_loop()
+    fingerprint, match = await loop.run_in_executor(None, find_fingerprint_match, extracted_frames, cache_key, video_path)
+    if match:
+        cached_result, matched_key, similarity = match
+        print(f"Reusing analysis of near-duplicate video {matched_key} (similarity {similarity:.2f})")
+        return cached_result["analysis"], {"cache_key": matched_key, "similarity": round(similarity, 3)}
+
+    gpt4_analysis = await process_frames(extracted_frames, analysis_type, custom_prompt)
+    if isinstance(gpt4_analysis, str):
+        fingerprint_index.add(cache_key, cache_key.split("_", 1)[1], fingerprint)
+    return gpt4_analysis, None
+
 def encode_image(image_path):
+    from PIL import Image
+
     # Resize image to reduce token usage
     with Image.open(image_path) as img:
         # Resize to max dimension 768px for better quality while balancing tokens
@@ -509,12 +1343,15 @@ BE CONFIDENT: You have the visual information. Provide definitive analysis."""
     ]
 
     try:
-        response = client.chat.completions.create(
+        # Run the blocking client call in a worker thread so concurrent analyses don't stall the event loop
+        loop = asyncio.get_event_loop()
+        response = await loop.run_in_executor(None, lambda: get_openai_client().chat.completions.create(
             model="gpt-4o",  # Use gpt-4o for best vision performance
             messages=messages,
             max_tokens=4000,  # Increased for detailed behavioral analysis
             temperature=0.7,  # Slight creativity for better descriptive language
-        )
+        ))
+        record_model_usage(response)
         return response.choices[0].message.content
     except Exception as e:
         error_msg = str(e)
@@ -522,15 +1359,16 @@ BE CONFIDENT: You have the visual information. Provide definitive analysis."""
              return {"error": "Rate limit exceeded. Try again in a moment."}
         return {"error": error_msg}
 
-async def process_chunk(chunk: bytes, chunk_number: int, total_chunks: int, analysis_type: str, custom_prompt: str = ""):
-    with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-        temp_file.write(chunk)
-        temp_file_path = temp_file.name
-
-    frames_folder = tempfile.mkdtemp()
+async def process_chunk(chunk: bytes, chunk_number: int, total_chunks: int, analysis_type: str, custom_prompt: str = "", cache_key: Optional[str] = None):
     try:
-        extracted_frames = extract_frames_smart(temp_file_path, frames_folder)
-        gpt4_analysis = await process_frames(extracted_frames, analysis_type, custom_prompt)
+        async with workspace_manager.job(len(chunk) + SCRATCH_FRAMES_ESTIMATE) as workspace:
+            video_path = workspace.path("input.mp4")
+            with open(video_path, "wb") as f:
+                f.write(chunk)
+
+            extracted_frames = extract_frames_smart(video_path, workspace.mkdir("frames"))
+            gpt4_analysis, fingerprint_match = await analyze_frames(extracted_frames, analysis_type, custom_prompt,
+                                                                    cache_key, video_path)
         
         result = {
             "chunk_number": chunk_number,
@@ -539,37 +1377,299 @@ async def process_chunk(chunk: bytes, chunk_number: int, total_chunks: int, anal
             "analysis": gpt4_analysis,
             "analysis_type": analysis_type
         }
+        if fingerprint_match:
+            result["fingerprint_match"] = fingerprint_match
     except Exception as e:
         result = {
             "error": str(e)
         }
-    finally:
-        # Clean up temporary files
-        os.unlink(temp_file_path)
-        shutil.rmtree(frames_folder)
     
     return result
 
-async def process_video_file(file_path: str, analysis_type: str, custom_prompt: str = ""):
-    frames_folder = tempfile.mkdtemp()
+async def process_video_file(file_path: str, analysis_type: str, custom_prompt: str = "", cache_key: Optional[str] = None, workspace: Optional[Workspace] = None):
+    """Analyze a video already on disk. Frames go into `workspace`, or a new job workspace if none is given."""
     try:
-        extracted_frames = extract_frames_smart(file_path, frames_folder)
-        gpt4_analysis = await process_frames(extracted_frames, analysis_type, custom_prompt)
+        if workspace is None:
+            async with workspace_manager.job(SCRATCH_FRAMES_ESTIMATE) as job_workspace:
+                return await process_video_file(file_path, analysis_type, custom_prompt, cache_key, job_workspace)
+
+        extracted_frames = extract_frames_smart(file_path, workspace.mkdir("frames"))
+        gpt4_analysis, fingerprint_match = await analyze_frames(extracted_frames, analysis_type, custom_prompt,
+                                                                cache_key, file_path)
         
         result = {
             "frames_extracted": len(extracted_frames),
             "analysis": gpt4_analysis,
             "analysis_type": analysis_type
         }
+        if fingerprint_match:
+            result["fingerprint_match"] = fingerprint_match
     except Exception as e:
         result = {
             "error": str(e)
         }
-    finally:
-        shutil.rmtree(frames_folder)
     return result
 
+class VideoWindowReader:
+    """Read a growing local file or a live stream in consecutive time windows.
+
+    Scene detection state, the read position and the sampling schedule carry over
+    between windows, so each window only decodes and extracts frames it hasn't seen.
+    Growing files should be in a streamable container (MKV, MPEG-TS, fragmented MP4);
+    a plain MP4 has its index at the end and can't be read until it is finished.
+
+    read_window runs in a worker thread. stop() may be called from any thread; the
+    reader then returns at the next frame and releases the capture itself.
+    """
+
+    def __init__(self, source, window_seconds=60.0, sample_interval=5.0, scene_threshold=25.0,
+                 idle_timeout=30.0, poll_interval=1.0):
+        self.source = source
+        self.is_stream = urlsplit(source).scheme.lower() in WATCH_STREAM_SCHEMES
+        self.window_seconds = window_seconds
+        self.sample_interval = sample_interval
+        self.idle_timeout = idle_timeout
+        self.poll_interval = poll_interval
+        self.detector = SceneDetector(scene_threshold)
+        self.cap = None
+        self.fps = 0
+        self.frames_read = 0
+        self.started_at = None
+        self.window_index = 0
+        self.window_start = 0.0
+        self.next_sample_at = 0.0
+        self.carry = None  # First frame of the next window, read while closing the previous one
+        self.ended = False
+        self.stopped = threading.Event()
+
+    def _open(self):
+        import cv2
+
+        self.cap = cv2.VideoCapture(self.source)
+        if not self.cap.isOpened():
+            return False
+        if not self.is_stream and self.frames_read:
+            # Resume a growing file where the previous read stopped
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, self.frames_read)
+        self.fps = self.cap.get(cv2.CAP_PROP_FPS) or self.fps
+        return True
+
+    def stop(self):
+        self.stopped.set()
+
+    def close(self):
+        # Only call from the thread running read_window, or when no read is in flight
+        if self.cap is not None:
+            self.cap.release()
+            self.cap = None
+
+    def _timestamp(self):
+        # Stream timestamps restart on reconnect, so live sources use wall-clock time
+        if self.is_stream or not self.fps:
+            return time.monotonic() - self.started_at
+        return (self.frames_read - 1) / self.fps
+
+    def _read_frame(self):
+        """Read the next frame, waiting for the source to grow until idle_timeout passes."""
+        idle_since = None
+        while not self.stopped.is_set():
+            if self.cap is not None:
+                ret, frame = self.cap.read()
+                if ret:
+                    self.frames_read += 1
+                    return frame
+            if idle_since is None:
+                idle_since = time.monotonic()
+            elif time.monotonic() - idle_since > self.idle_timeout:
+                return None
+            # End of what's available so far: reopen to pick up new data
+            self.close()
+            if self.stopped.wait(self.poll_interval):
+                break
+            self._open()
+        return None
+
+    def _open_first(self):
+        """Open the source, waiting up to idle_timeout for a just-created file to get its headers."""
+        deadline = time.monotonic() + self.idle_timeout
+        while not self._open():
+            self.close()
+            if time.monotonic() >= deadline:
+                raise Exception(f"Failed to open video source: {self.source}")
+            if self.stopped.wait(self.poll_interval):
+                return False
+        self.started_at = time.monotonic()
+        return True
+
+    def read_window(self, output_folder, max_frames=10):
+        """Extract the sampled and scene-change frames of the next window into output_folder.
+
+        Windows in which nothing was sampled are skipped. Returns a window dict, or None
+        once the source has stopped producing frames or stop() was called.
+        """
+        try:
+            if self.started_at is None and not self._open_first():
+                self.ended = True
+                return None
+
+            os.makedirs(output_folder, exist_ok=True)
+            while not self.ended:
+                window = self._read_one_window(output_folder, max_frames)
+                if self.stopped.is_set():
+                    self.ended = True
+                    return None
+                if window is not None:
+                    return window
+            return None
+        finally:
+            # Release the capture on the thread that reads it, never while another thread is inside read()
+            if self.ended:
+                self.close()
+
+    def _read_one_window(self, output_folder, max_frames):
+        import cv2
+        import numpy as np
+
+        window_end = self.window_start + self.window_seconds
+        frames = []
+        scene_changes = 0
+        last_timestamp = self.window_start
+
+        while True:
+            if self.carry is not None:
+                timestamp, frame, is_scene = self.carry
+                self.carry = None
+            else:
+                frame = self._read_frame()
+                if frame is None:
+                    self.ended = True
+                    break
+                timestamp = self._timestamp()
+                is_scene = self.detector.is_scene_change(frame)
+                if timestamp >= window_end:
+                    self.carry = (timestamp, frame, is_scene)
+                    break
+
+            last_timestamp = timestamp
+            scene_changes += int(is_scene)
+            if is_scene or timestamp >= self.next_sample_at:
+                path = os.path.join(output_folder, f"frame_{len(frames):04d}.jpg")
+                cv2.imwrite(path, frame)
+                frames.append(path)
+                if timestamp >= self.next_sample_at:
+                    self.next_sample_at = timestamp + self.sample_interval
+
+        if not frames:
+            # Nothing sampled in this window; move on so the next call reads the following one
+            self.window_start = window_end
+            return None
+
+        # Cap at max_frames, spread evenly so the end of the window is still covered
+        if len(frames) > max_frames:
+            indices = np.linspace(0, len(frames) - 1, max_frames).round().astype(int)
+            frames = [frames[i] for i in indices]
+
+        window = {
+            "window_index": self.window_index,
+            "start_seconds": round(self.window_start, 2),
+            "end_seconds": round(last_timestamp, 2),
+            "frames": frames,
+            "scene_changes": scene_changes,
+        }
+        self.window_index += 1
+        self.window_start = window_end
+        return window
+
+def update_rolling_summary(previous_summary, window, window_analysis, analysis_type):
+    """Fold one window's analysis into the running summary without re-reading earlier windows."""
+    focus = ANALYSIS_TYPES.get(analysis_type, "")
+    system_message = f"""You maintain a running summary of a long video that is being analyzed window by window.
+Merge the newest window's analysis into the existing summary. Keep recurring patterns, trends over time and notable
+events with their approximate timestamps. Drop repetition. Keep the summary under 400 words.
+Analysis focus: {focus}"""
+    messages = [
+        {"role": "system", "content": system_message},
+        {"role": "user", "content": f"Current Summary:\n{previous_summary or '(none yet)'}\n\n"
+                                    f"New Window ({window['start_seconds']}s - {window['end_seconds']}s):\n{window_analysis}\n\n"
+                                    f"Please provide the updated summary:"}
+    ]
+    response = get_openai_client().chat.completions.create(
+        model=REFINE_MODEL,
+        messages=messages,
+        max_tokens=1000
+    )
+    record_model_usage(response)
+    return response.choices[0].message.content
+
+async def watch_video(source: str, analysis_type: str, custom_prompt: str = "", window_seconds: float = 60.0,
+                      sample_interval: float = 5.0, idle_timeout: float = 30.0):
+    """Analyze a growing file or live stream window by window.
+
+    Yields a "window" event as each window closes and a "summary" event with the updated
+    rolling summary after it, then a final "end" event.
+    """
+    reader = VideoWindowReader(source, window_seconds=window_seconds, sample_interval=sample_interval,
+                               idle_timeout=idle_timeout)
+    loop = asyncio.get_event_loop()
+    summary = ""
+    workspace = None
+    try:
+        # One workspace for the session; each window's frames are removed once analyzed
+        workspace = await workspace_manager.acquire(SCRATCH_FRAMES_ESTIMATE)
+        while True:
+            frames_folder = workspace.mkdir(f"window_{reader.window_index:05d}")
+            read = loop.run_in_executor(None, reader.read_window, frames_folder)
+            try:
+                # Shielded so a cancelled request leaves `read` pending instead of marking it done
+                window = await asyncio.shield(read)
+                if window is None:
+                    break
+                await wait_for_rate_limit()
+                analysis = await process_frames(window["frames"], analysis_type, custom_prompt)
+            finally:
+                if not read.done():
+                    # Client went away mid-read: stop the reader and wait for its thread
+                    # to finish writing frames before removing them
+                    reader.stop()
+                    await asyncio.wait([read])
+                shutil.rmtree(frames_folder, ignore_errors=True)
+
+            yield {
+                "type": "window",
+                "window_index": window["window_index"],
+                "start_seconds": window["start_seconds"],
+                "end_seconds": window["end_seconds"],
+                "frames_extracted": len(window["frames"]),
+                "scene_changes": window["scene_changes"],
+                "analysis": analysis,
+                "analysis_type": analysis_type,
+            }
+
+            if isinstance(analysis, str):
+                await wait_for_rate_limit()
+                try:
+                    summary = await loop.run_in_executor(None, update_rolling_summary, summary, window, analysis, analysis_type)
+                    yield {"type": "summary", "window_index": window["window_index"], "summary": summary}
+                except Exception as e:
+                    yield {"type": "summary", "window_index": window["window_index"], "error": str(e)}
+    except Exception as e:
+        yield {"type": "error", "error": str(e)}
+    finally:
+        # No read is in flight by now, so closing from here can't race the reader thread
+        reader.stop()
+        reader.close()
+        if workspace is not None:
+            workspace_manager.release(workspace)
+
+    yield {"type": "end", "windows": reader.window_index, "summary": summary}
+
+def pdf_text(text):
+    # FPDF's core fonts are latin-1 only; replace anything else instead of failing the export
+    return str(text).encode('latin-1', 'replace').decode('latin-1')
+
 def generate_pdf(result):
+    from fpdf import FPDF
+
     pdf = FPDF()
     pdf.add_page()
     pdf.set_font("Arial", size=12)
@@ -579,11 +1679,11 @@ def generate_pdf(result):
     pdf.ln(10)
     
     pdf.set_font("Arial", 'B', 12)
-    pdf.cell(200, 10, txt=f"Filename: {result.get('filename', 'N/A')}", ln=1)
-    pdf.cell(200, 10, txt=f"Analysis Type: {result.get('analysis_type', 'N/A')}", ln=1)
+    pdf.multi_cell(0, 10, txt=pdf_text(f"Filename: {result.get('filename', 'N/A')}"))
+    pdf.cell(200, 10, txt=pdf_text(f"Analysis Type: {result.get('analysis_type', 'N/A')}"), ln=1)
     
     if 'custom_prompt' in result and result['custom_prompt']:
-        pdf.cell(200, 10, txt=f"Custom Prompt: {result['custom_prompt']}", ln=1)
+        pdf.multi_cell(0, 10, txt=pdf_text(f"Custom Prompt: {result['custom_prompt']}"))
     
     pdf.ln(10)
     
@@ -597,10 +1697,8 @@ def generate_pdf(result):
             pdf.set_font("Arial", 'B', 12)
             pdf.cell(200, 10, txt="GPT-4 Analysis:", ln=1)
             pdf.set_font("Arial", '', 12)
-            text = chunk['analysis']
-            wrapped_text = textwrap.wrap(text, width=90)
-            for line in wrapped_text:
-                pdf.cell(0, 10, txt=line, ln=1)
+            # multi_cell wraps the whole block in one call instead of one cell per wrapped line
+            pdf.multi_cell(0, 8, txt=pdf_text(chunk['analysis']))
             pdf.ln(10)
     else:
         pdf.set_font("Arial", '', 12)
@@ -609,10 +1707,7 @@ def generate_pdf(result):
         pdf.set_font("Arial", 'B', 12)
         pdf.cell(200, 10, txt="GPT-4 Analysis:", ln=1)
         pdf.set_font("Arial", '', 12)
-        text = result.get('analysis', 'N/A')
-        wrapped_text = textwrap.wrap(text, width=90)
-        for line in wrapped_text:
-            pdf.cell(0, 10, txt=line, ln=1)
+        pdf.multi_cell(0, 8, txt=pdf_text(result.get('analysis', 'N/A')))
     
     return pdf.output(dest='S').encode('latin-1')
 
@@ -635,6 +1730,160 @@ def generate_markdown(result):
     
     return md
 
+# Export artifacts are rendered once per (cache_key, format) and stored next to the cached result
+EXPORT_FORMATS = {
+    "pdf": {"extension": ".pdf", "media_type": "application/pdf", "filename": "analysis_result.pdf"},
+    "markdown": {"extension": ".md", "media_type": "text/markdown", "filename": "analysis_result.md"},
+}
+EXPORT_CHUNK_SIZE = 64 * 1024
+EXPORT_LOCK_STRIPES = 64
+EXPORT_JOB_RETENTION = 3600  # Seconds a finished export batch stays pollable
+
+export_jobs = {}  # job_id -> status dict for background export batches
+# A fixed pool of locks shared by hash, so memory stays bounded however many results are exported
+export_locks = [threading.Lock() for _ in range(EXPORT_LOCK_STRIPES)]
+
+def get_export_path(cache_key, format):
+    return CACHE_DIR / f"{cache_key}{EXPORT_FORMATS[format]['extension']}"
+
+def render_export_content(result, format):
+    if format == "pdf":
+        return generate_pdf(result)
+    return generate_markdown(result).encode()
+
+def render_export(cache_key, format):
+    """Return the path of the rendered export, rendering it only if missing or stale."""
+    if not is_valid_cache_key(cache_key):
+        raise ValueError("Invalid cache key")
+    cache_file = CACHE_DIR / f"{cache_key}.json"
+    if not cache_file.exists():
+        return None
+
+    export_path = get_export_path(cache_key, format)
+    lock = export_locks[hash((cache_key, format)) % EXPORT_LOCK_STRIPES]
+
+    # Concurrent requests for the same artifact wait for a single render
+    with lock:
+        if export_path.exists() and export_path.stat().st_mtime >= cache_file.stat().st_mtime:
+            return export_path
+
+        result = get_cached_result(cache_key)
+        content = render_export_content(result, format)
+
+        # Write atomically so readers never see a partially rendered file
+        temp_path = export_path.with_name(export_path.name + f".{uuid.uuid4().hex}.tmp")
+        with temp_path.open("wb") as f:
+            f.write(content)
+        os.replace(temp_path, export_path)
+        return export_path
+
+def get_etag(path):
+    stat = path.stat()
+    return '"' + hashlib.md5(f"{path.name}-{stat.st_mtime_ns}-{stat.st_size}".encode()).hexdigest() + '"'
+
+def parse_range_header(range_header, file_size):
+    """Parse a single 'bytes=start-end' range into inclusive (start, end).
+
+    Returns None for ranges we don't support (other units, multiple ranges), which
+    callers answer with the full body. Raises ValueError if the range is unsatisfiable.
+    """
+    units, _, spec = range_header.partition("=")
+    if units.strip() != "bytes" or "," in spec:
+        return None
+    start_str, _, end_str = spec.strip().partition("-")
+    try:
+        if start_str == "":
+            # Suffix range: the last N bytes
+            length = int(end_str)
+            if length <= 0:
+                raise ValueError("Empty suffix range")
+            start = max(0, file_size - length)
+            end = file_size - 1
+        else:
+            start = int(start_str)
+            end = int(end_str) if end_str else file_size - 1
+    except ValueError:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    end = min(end, file_size - 1)
+    if start > end or start >= file_size:
+        raise ValueError(f"Unsatisfiable range: {range_header}")
+    return start, end
+
+def iter_file_range(path, start, end):
+    with path.open("rb") as f:
+        f.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = f.read(min(EXPORT_CHUNK_SIZE, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+
+def serve_artifact(request: Request, path: Path, media_type: str, filename: str):
+    """Serve a stored artifact with ETag/If-None-Match and single byte-range support."""
+    etag = get_etag(path)
+    file_size = path.stat().st_size
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "private, max-age=0, must-revalidate",
+        "Content-Disposition": f"attachment; filename={filename}",
+    }
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match:
+        candidates = [tag.strip() for tag in if_none_match.split(",")]
+        if "*" in candidates or etag in candidates or f"W/{etag}" in candidates:
+            return Response(status_code=304, headers={"ETag": etag})
+
+    range_header = request.headers.get("range")
+    # If-Range: only honour the range when the client's copy is still current
+    if range_header and request.headers.get("if-range", etag) == etag:
+        try:
+            byte_range = parse_range_header(range_header, file_size)
+        except ValueError:
+            return Response(status_code=416, headers={"Content-Range": f"bytes */{file_size}"})
+        if byte_range is not None:
+            start, end = byte_range
+            headers["Content-Range"] = f"bytes {start}-{end}/{file_size}"
+            headers["Content-Length"] = str(end - start + 1)
+            return StreamingResponse(iter_file_range(path, start, end), status_code=206, media_type=media_type, headers=headers)
+
+    headers["Content-Length"] = str(file_size)
+    return StreamingResponse(iter_file_range(path, 0, file_size - 1), media_type=media_type, headers=headers)
+
+def expire_export_jobs():
+    cutoff = time.time() - EXPORT_JOB_RETENTION
+    for job_id, job in list(export_jobs.items()):
+        if job["finished_at"] is not None and job["finished_at"] < cutoff:
+            export_jobs.pop(job_id, None)
+
+def run_export_batch(job_id, cache_keys, formats):
+    job = export_jobs[job_id]
+    job["status"] = "running"
+
+    def render_one(cache_key, format):
+        try:
+            path = render_export(cache_key, format)
+            if path is None:
+                return cache_key, format, "Result not found"
+            return cache_key, format, None
+        except Exception as e:
+            return cache_key, format, str(e)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        futures = [executor.submit(render_one, key, fmt) for key in cache_keys for fmt in formats]
+        for future in as_completed(futures):
+            cache_key, format, error = future.result()
+            if error:
+                job["failed"].append({"cache_key": cache_key, "format": format, "error": error})
+            else:
+                job["rendered"] += 1
+
+    job["status"] = "completed"
+    job["finished_at"] = time.time()
+
 @app.post("/upload_chunk")
 async def upload_chunk(
     chunk: UploadFile = File(...),
@@ -647,6 +1896,15 @@ async def upload_chunk(
     result = await process_chunk(chunk_content, chunk_number, total_chunks, analysis_type, custom_prompt)
     return JSONResponse(result)
 
+def analysis_response(result, cache_key, source, source_type, custom_prompt=""):
+    """Record the analysis in history and return it with the keys the client needs to refer back to it."""
+    try:
+        history_id = record_history(result, cache_key, source, source_type, custom_prompt)
+    except sqlite3.Error as e:
+        print(f"Failed to record history: {e}")
+        history_id = None
+    return JSONResponse({**result, "cache_key": cache_key, "history_id": history_id})
+
 @app.post("/upload")
 async def upload_video(
     file: Optional[UploadFile] = File(None),
@@ -664,43 +1922,33 @@ async def upload_video(
         # Handle URL download
         cache_key = get_cache_key(url.encode(), f"{analysis_type}_{custom_prompt}")
         cached_result = get_cached_result(cache_key)
+        record_cache_lookup("analysis", cached_result is not None)
         if cached_result:
-            return JSONResponse(cached_result)
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp4") as temp_file:
-            temp_file_path = temp_file.name
+            return analysis_response(cached_result, cache_key, url, "url", custom_prompt)
         
         try:
-            print(f"Downloading video from URL: {url}")
-            download_video(url, temp_file_path)
-            
-            # Verify file was created and has content
-            if not os.path.exists(temp_file_path):
-                raise Exception("Video download failed - file not created")
-            
-            file_size = os.path.getsize(temp_file_path)
-            if file_size == 0:
-                raise Exception("Video download failed - empty file")
-            
-            print(f"Video downloaded successfully ({file_size} bytes), processing...")
-            result = await process_video_file(temp_file_path, analysis_type, custom_prompt)
+            async with workspace_manager.job(SCRATCH_DOWNLOAD_ESTIMATE) as workspace:
+                print(f"Downloading video from URL: {url}")
+                video_path = download_video(url, workspace)
+                
+                # Verify file was created and has content
+                if not os.path.exists(video_path):
+                    raise Exception("Video download failed - file not created")
+                
+                file_size = os.path.getsize(video_path)
+                if file_size == 0:
+                    raise Exception("Video download failed - empty file")
+                
+                print(f"Video downloaded successfully ({file_size} bytes), processing...")
+                result = await process_video_file(video_path, analysis_type, custom_prompt, cache_key, workspace)
             result["filename"] = url
             
             if "error" in result:
-                if os.path.exists(temp_file_path):
-                    os.unlink(temp_file_path)
                 return JSONResponse(content={"error": result["error"]}, status_code=500)
             
             save_to_cache(cache_key, result)
-            if os.path.exists(temp_file_path):
-                os.unlink(temp_file_path)
-            return JSONResponse(result)
+            return analysis_response(result, cache_key, url, "url", custom_prompt)
         except Exception as e:
-            if os.path.exists(temp_file_path):
-                try:
-                    os.unlink(temp_file_path)
-                except:
-                    pass
             error_message = str(e)
             print(f"Error processing URL: {error_message}")
             return JSONResponse(content={"error": f"Failed to process video from URL. {error_message}"}, status_code=500)
@@ -711,33 +1959,72 @@ async def upload_video(
         cache_key = get_cache_key(file_content, f"{analysis_type}_{custom_prompt}")
         
         cached_result = get_cached_result(cache_key)
+        record_cache_lookup("analysis", cached_result is not None)
         if cached_result:
-            return JSONResponse(cached_result)
+            return analysis_response(cached_result, cache_key, file.filename, "file", custom_prompt)
 
         # Process the entire video
-        result = await process_chunk(file_content, 1, 1, analysis_type, custom_prompt)
+        result = await process_chunk(file_content, 1, 1, analysis_type, custom_prompt, cache_key)
         result["filename"] = file.filename
         
         if "error" in result:
             return JSONResponse(content={"error": result["error"]}, status_code=500)
             
         save_to_cache(cache_key, result)
-        return JSONResponse(result)
+        return analysis_response(result, cache_key, file.filename, "file", custom_prompt)
+
+@app.post("/watch")
+async def watch_source(
+    source: str = Form(...),
+    analysis_type: str = Form(...),
+    custom_prompt: str = Form(""),
+    window_seconds: float = Form(60.0),
+    sample_interval: float = Form(5.0),
+    idle_timeout: float = Form(30.0)
+):
+    """Stream newline-delimited JSON events while a growing file or live stream is analyzed."""
+    if window_seconds <= 0 or sample_interval <= 0:
+        raise HTTPException(status_code=400, detail="window_seconds and sample_interval must be positive.")
+    if sample_interval > window_seconds:
+        raise HTTPException(status_code=400, detail="sample_interval must not exceed window_seconds.")
+
+    if urlsplit(source).scheme.lower() not in WATCH_STREAM_SCHEMES:
+        # file: URLs and other FFmpeg protocols must pass the same containment check as plain paths
+        if not WATCH_ROOT:
+            raise HTTPException(status_code=403, detail="Watching local files requires WATCH_ROOT to be configured.")
+        if source.lower().startswith("file:"):
+            source = unquote(urlsplit(source).path)
+        root = Path(WATCH_ROOT).resolve()
+        path = (root / source).resolve()
+        if root != path and root not in path.parents:
+            raise HTTPException(status_code=403, detail="Source must be inside WATCH_ROOT.")
+        source = str(path)
+
+    async def events():
+        async for event in watch_video(source, analysis_type, custom_prompt, window_seconds, sample_interval, idle_timeout):
+            yield json.dumps(event) + "\n"
+
+    return StreamingResponse(events(), media_type="application/x-ndjson")
 
 class RefineRequest(BaseModel):
     original_analysis: str
     refinement_prompt: str
     analysis_type: str
 
-@app.post("/refine")
-async def refine_analysis(request: RefineRequest):
-    if not rate_limiter.consume(1):
-        raise HTTPException(status_code=429, detail="Rate limit exceeded.")
+class BatchRefineRequest(BaseModel):
+    original_analysis: str
+    refinement_prompts: List[str]
+    analysis_type: str
 
+def get_refine_cache_key(original_analysis, refinement_prompt, analysis_type, model=REFINE_MODEL):
+    payload = json.dumps([original_analysis, refinement_prompt, analysis_type, model])
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+def refine_with_model(original_analysis, refinement_prompt, analysis_type):
     # Build dynamic system message based on analysis type
     analysis_context = ""
-    if request.analysis_type in ANALYSIS_TYPES:
-        analysis_context = f"\n\nOriginal Analysis Context: The video was analyzed using the '{request.analysis_type}' model with this focus: {ANALYSIS_TYPES[request.analysis_type]}"
+    if analysis_type in ANALYSIS_TYPES:
+        analysis_context = f"\n\nOriginal Analysis Context: The video was analyzed using the '{analysis_type}' model with this focus: {ANALYSIS_TYPES[analysis_type]}"
     
     system_message = f"""You are an expert technical editor and analyst. You will be provided with:
 1. A previous analysis of a video
@@ -755,54 +2042,250 @@ CRITICAL RULES:
     
     messages = [
         {"role": "system", "content": system_message},
-        {"role": "user", "content": f"Original Analysis:\n{request.original_analysis}\n\nUser Refinement Request:\n{request.refinement_prompt}\n\nPlease provide the refined analysis:"}
+        {"role": "user", "content": f"Original Analysis:\n{original_analysis}\n\nUser Refinement Request:\n{refinement_prompt}\n\nPlease provide the refined analysis:"}
     ]
 
+    response = get_openai_client().chat.completions.create(
+        model=REFINE_MODEL,  # Use gpt-4o for best refinement quality
+        messages=messages,
+        max_tokens=2000
+    )
+    record_model_usage(response)
+    return response.choices[0].message.content
+
+async def run_refinement(cache_key, original_analysis, refinement_prompt, analysis_type):
+    """Run one uncached refinement off the event loop and cache the result."""
+    loop = asyncio.get_event_loop()
+    refined_text = await loop.run_in_executor(None, refine_with_model, original_analysis, refinement_prompt, analysis_type)
+    save_to_cache(cache_key, {"analysis": refined_text}, REFINE_CACHE_DIR)
+    return refined_text
+
+@app.post("/refine")
+async def refine_analysis(request: RefineRequest):
+    cache_key = get_refine_cache_key(request.original_analysis, request.refinement_prompt, request.analysis_type)
+    cached_result = get_cached_result(cache_key, REFINE_CACHE_DIR)
+    record_cache_lookup("refine", cached_result is not None)
+    if cached_result:
+        return JSONResponse({"analysis": cached_result["analysis"], "cached": True})
+
+    if not rate_limiter.consume(1):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded.")
+
     try:
-        response = client.chat.completions.create(
-            model="gpt-4o",  # Use gpt-4o for best refinement quality
-            messages=messages,
-            max_tokens=2000
-        )
-        refined_text = response.choices[0].message.content
-        return JSONResponse({"analysis": refined_text})
+        refined_text = await run_refinement(cache_key, request.original_analysis, request.refinement_prompt, request.analysis_type)
+        return JSONResponse({"analysis": refined_text, "cached": False})
     except Exception as e:
         return JSONResponse(content={"error": str(e)}, status_code=500)
 
+@app.post("/refine/batch")
+async def refine_analysis_batch(request: BatchRefineRequest):
+    if not request.refinement_prompts:
+        raise HTTPException(status_code=400, detail="At least one refinement prompt is required.")
+    if len(request.refinement_prompts) > MAX_BATCH_REFINEMENTS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_REFINEMENTS} refinement prompts per batch.")
+
+    results = {}
+    pending = {}  # cache_key -> refinement_prompt, deduplicates repeated prompts
+    for refinement_prompt in request.refinement_prompts:
+        cache_key = get_refine_cache_key(request.original_analysis, refinement_prompt, request.analysis_type)
+        if cache_key in results or cache_key in pending:
+            continue
+        cached_result = get_cached_result(cache_key, REFINE_CACHE_DIR)
+        record_cache_lookup("refine", cached_result is not None)
+        if cached_result:
+            results[cache_key] = {"analysis": cached_result["analysis"], "cached": True}
+        else:
+            pending[cache_key] = refinement_prompt
+
+    # Each model call costs one rate limiter token; reserve them for the whole batch up front
+    if pending and not rate_limiter.consume(len(pending)):
+        raise HTTPException(status_code=429, detail="Rate limit exceeded.")
+
+    outcomes = await asyncio.gather(
+        *[run_refinement(cache_key, request.original_analysis, refinement_prompt, request.analysis_type)
+          for cache_key, refinement_prompt in pending.items()],
+        return_exceptions=True
+    )
+    for cache_key, outcome in zip(pending, outcomes):
+        if isinstance(outcome, Exception):
+            results[cache_key] = {"error": str(outcome)}
+        else:
+            results[cache_key] = {"analysis": outcome, "cached": False}
+
+    return JSONResponse({"results": [
+        {"refinement_prompt": refinement_prompt, **results[get_refine_cache_key(request.original_analysis, refinement_prompt, request.analysis_type)]}
+        for refinement_prompt in request.refinement_prompts
+    ]})
+
+@app.get("/ready")
+async def readiness():
+    """Report which heavy subsystems are loaded. The server itself is ready once this responds."""
+    subsystems = {
+        name: {"warm": is_subsystem_warm(name), **subsystem_status[name]}
+        for name in SUBSYSTEMS
+    }
+    return JSONResponse({
+        "ready": True,
+        "all_warm": all(status["warm"] for status in subsystems.values()),
+        "warmup": warmup_state,
+        "subsystems": subsystems,
+    })
+
+@app.get("/workspace_stats")
+async def get_workspace_stats():
+    """Scratch disk usage: quota, reservations, active and waiting jobs, and orphan sweeps."""
+    loop = asyncio.get_event_loop()
+    # Walking the scratch tree can take a moment on a busy server
+    return JSONResponse(await loop.run_in_executor(None, workspace_manager.stats))
+
 @app.get("/analysis_types")
 async def get_analysis_types():
     return JSONResponse(ANALYSIS_TYPES)
 
 @app.get("/download/{format}/{cache_key}")
-async def download_result(format: str, cache_key: str):
-    result = get_cached_result(cache_key)
-    if not result:
+async def download_result(request: Request, format: str, cache_key: str):
+    if format != "json" and format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail="Invalid format")
+    if not is_valid_cache_key(cache_key):
         raise HTTPException(status_code=404, detail="Result not found")
-    
+
     if format == "json":
-        return JSONResponse(result)
-    elif format == "pdf":
-        pdf_content = generate_pdf(result)
-        return FileResponse(
-            io.BytesIO(pdf_content),
-            media_type="application/pdf",
-            headers={"Content-Disposition": f"attachment; filename=analysis_result.pdf"}
-        )
-    elif format == "markdown":
-        md_content = generate_markdown(result)
-        return FileResponse(
-            io.BytesIO(md_content.encode()),
-            media_type="text/markdown",
-            headers={"Content-Disposition": f"attachment; filename=analysis_result.md"}
-        )
-    else:
-        raise HTTPException(status_code=400, detail="Invalid format")
+        path = CACHE_DIR / f"{cache_key}.json"
+        if not path.exists():
+            raise HTTPException(status_code=404, detail="Result not found")
+        return serve_artifact(request, path, "application/json", "analysis_result.json")
+
+    loop = asyncio.get_event_loop()
+    path = await loop.run_in_executor(None, render_export, cache_key, format)
+    if path is None:
+        raise HTTPException(status_code=404, detail="Result not found")
+
+    export_format = EXPORT_FORMATS[format]
+    return serve_artifact(request, path, export_format["media_type"], export_format["filename"])
+
+class ExportBatchRequest(BaseModel):
+    cache_keys: Optional[List[str]] = None  # None renders every cached result
+    formats: List[str] = list(EXPORT_FORMATS)
+
+@app.post("/exports/batch")
+async def create_export_batch(request: ExportBatchRequest, background_tasks: BackgroundTasks):
+    invalid = [fmt for fmt in request.formats if fmt not in EXPORT_FORMATS]
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid format(s): {', '.join(invalid)}")
+
+    cache_keys = request.cache_keys
+    if cache_keys is None:
+        cache_keys = sorted(path.stem for path in CACHE_DIR.glob("*.json") if is_valid_cache_key(path.stem))
+
+    expire_export_jobs()
+    job_id = uuid.uuid4().hex
+    export_jobs[job_id] = {
+        "job_id": job_id,
+        "status": "queued",
+        "total": len(cache_keys) * len(request.formats),
+        "rendered": 0,
+        "failed": [],
+        "created_at": time.time(),
+        "finished_at": None,
+    }
+    background_tasks.add_task(run_export_batch, job_id, cache_keys, request.formats)
+    return JSONResponse(export_jobs[job_id], status_code=202)
+
+@app.get("/exports/batch/{job_id}")
+async def get_export_batch(job_id: str):
+    job = export_jobs.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    return JSONResponse(job)
+
+@app.get("/cache_stats")
+async def get_cache_stats():
+    def disk_usage(cache_dir):
+        files = list(cache_dir.glob("*.json")) if cache_dir.exists() else []
+        return {"entries": len(files), "bytes": sum(f.stat().st_size for f in files)}
+
+    stats = {}
+    cache_dirs = {"analysis": CACHE_DIR, "refine": REFINE_CACHE_DIR}
+    for namespace, counters in cache_stats.items():
+        lookups = counters["hits"] + counters["misses"]
+        stats[namespace] = {
+            **counters,
+            "hit_rate": counters["hits"] / lookups if lookups else 0.0,
+        }
+        if namespace in cache_dirs:
+            stats[namespace].update(disk_usage(cache_dirs[namespace]))
+    stats["fingerprint"]["enabled"] = FINGERPRINT_SIMILARITY_THRESHOLD is not None
+    stats["fingerprint"]["indexed_videos"] = len(fingerprint_index)
+    return JSONResponse(stats)
+
+class HistoryRefinementsRequest(BaseModel):
+    refinements: List[dict]
+
+class HistoryImportRequest(BaseModel):
+    entries: List[dict]
+
+@app.get("/history")
+async def get_history(
+    limit: int = 20,
+    cursor: Optional[str] = None,
+    analysis_type: Optional[str] = None,
+    source: Optional[str] = None,
+    cache_key: Optional[str] = None,
+    since: Optional[float] = None,
+    until: Optional[float] = None,
+    q: Optional[str] = None
+):
+    """Paginated summary rows, newest first. Pass next_cursor back as cursor for the next page."""
+    limit = max(1, min(limit, MAX_HISTORY_PAGE_SIZE))
+    try:
+        position = decode_history_cursor(cursor) if cursor else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    items, total, next_cursor = list_history(limit, position, analysis_type, source, cache_key, since, until, q)
+    return JSONResponse({"items": items, "total": total, "next_cursor": next_cursor})
+
+@app.post("/history/import")
+async def import_history(request: HistoryImportRequest):
+    """Migrate history kept in browser localStorage by older clients into the history store."""
+    if len(request.entries) > MAX_HISTORY_IMPORT_ENTRIES:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_HISTORY_IMPORT_ENTRIES} entries can be imported at once")
+    try:
+        imported = import_legacy_history(request.entries)
+    except sqlite3.Error as e:
+        raise HTTPException(status_code=500, detail=f"Failed to import history: {e}")
+    return JSONResponse({"imported": imported})
+
+@app.get("/history/{history_id}")
+async def get_history_item(history_id: int):
+    entry = get_history_entry(history_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return JSONResponse(entry)
+
+@app.put("/history/{history_id}/refinements")
+async def set_history_refinements(history_id: int, request: HistoryRefinementsRequest):
+    if not update_history_refinements(history_id, request.refinements):
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return JSONResponse({"id": history_id, "refinement_count": len(request.refinements)})
+
+@app.delete("/history/{history_id}")
+async def delete_history_item(history_id: int):
+    if not delete_history(history_id):
+        raise HTTPException(status_code=404, detail="History entry not found")
+    return JSONResponse({"message": "History entry deleted"})
+
+@app.delete("/history")
+async def clear_history():
+    deleted = delete_history()
+    return JSONResponse({"message": "History cleared", "deleted": deleted})
 
 @app.post("/clear_cache")
 async def clear_cache():
     try:
-        shutil.rmtree(CACHE_DIR)
+        if CACHE_DIR.exists():
+            shutil.rmtree(CACHE_DIR)
         CACHE_DIR.mkdir(exist_ok=True)
+        fingerprint_index.clear()
         return JSONResponse({"message": "Cache cleared successfully"})
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Failed to clear cache: {str(e)}")
@@ -6,6 +6,7 @@ import { faRobot, faSpinner, faUpload, faFileVideo, faCopy, faTrashAlt, faEnvelo
 import { faTwitter, faLinkedin, faGithub } from '@fortawesome/free-brands-svg-icons';
 
 const BACKEND_URL = 'http://127.0.0.1:8000';
+const HISTORY_PAGE_SIZE = 20;
 
 const loadingMessages = [
   "Initializing neural network pathways...",
@@ -57,7 +58,13 @@ function App() {
   const [isFirstUpload, setIsFirstUpload] = useState(true);
   const [isDragging, setIsDragging] = useState(false);
   const [showHistory, setShowHistory] = useState(false);
-  const [history, setHistory] = useState([]);
+  const [history, setHistory] = useState([]); // Summary rows from the backend history store
+  const [historyTotal, setHistoryTotal] = useState(0);
+  const [historyCursor, setHistoryCursor] = useState(null);
+  const [historyQuery, setHistoryQuery] = useState(''); // Search box contents
+  const [submittedHistoryQuery, setSubmittedHistoryQuery] = useState(''); // Query the loaded pages belong to
+  const [historyLoading, setHistoryLoading] = useState(false);
+  const [currentHistoryId, setCurrentHistoryId] = useState(null);
   
   // Refinement states - moved to per-refinement tracking
   const [refiningIndex, setRefiningIndex] = useState(null); // null means not refining, -1 = original, 0+ is refinement index
@@ -66,10 +73,15 @@ function App() {
   // Ref for auto-scrolling to result
   const resultRef = useRef(null);
   const fileInputRef = useRef(null);
+  const legacyImportRef = useRef(null);
 
   useEffect(() => {
     loadStateFromStorage();
-    loadHistoryFromStorage();
+    // StrictMode runs effects twice in development; import the legacy history only once
+    if (!legacyImportRef.current) {
+      legacyImportRef.current = importLegacyHistory();
+    }
+    legacyImportRef.current.then(() => loadHistory());
   }, []);
 
   // Load state from localStorage
@@ -81,21 +93,49 @@ function App() {
         if (parsed.result) setResult(parsed.result);
         if (parsed.refinements) setRefinements(parsed.refinements);
         if (parsed.analysisType) setAnalysisType(parsed.analysisType);
+        if (parsed.historyId) setCurrentHistoryId(parsed.historyId);
       }
     } catch (error) {
       console.error('Error loading state:', error);
     }
   };
 
-  // Load history from localStorage
-  const loadHistoryFromStorage = () => {
+  // History used to live in localStorage; move it to the backend store, and only
+  // drop the local copy once the backend has it so a failed import is retried
+  const importLegacyHistory = async () => {
+    let entries;
+    try {
+      entries = JSON.parse(localStorage.getItem('frameInsight_history') || 'null');
+    } catch (error) {
+      console.error('Error reading legacy history:', error);
+      return;
+    }
+    if (!Array.isArray(entries)) return;
     try {
-      const savedHistory = localStorage.getItem('frameInsight_history');
-      if (savedHistory) {
-        setHistory(JSON.parse(savedHistory));
+      if (entries.length > 0) {
+        await axios.post(`${BACKEND_URL}/history/import`, { entries });
       }
+      localStorage.removeItem('frameInsight_history');
+    } catch (error) {
+      console.error('Error importing legacy history:', error);
+    }
+  };
+
+  // Load a page of history summaries; pass a cursor to append the next page
+  const loadHistory = async (cursor = null, query = submittedHistoryQuery) => {
+    setHistoryLoading(true);
+    try {
+      const params = { limit: HISTORY_PAGE_SIZE };
+      if (cursor) params.cursor = cursor;
+      if (query.trim()) params.q = query.trim();
+      const response = await axios.get(`${BACKEND_URL}/history`, { params });
+      setHistory(prev => cursor ? [...prev, ...response.data.items] : response.data.items);
+      setHistoryTotal(response.data.total);
+      setHistoryCursor(response.data.next_cursor);
     } catch (error) {
       console.error('Error loading history:', error);
+    } finally {
+      setHistoryLoading(false);
     }
   };
 
@@ -107,13 +147,14 @@ function App() {
           result,
           refinements,
           analysisType,
+          historyId: currentHistoryId,
           timestamp: new Date().toISOString()
         }));
       } catch (error) {
         console.error('Error saving state:', error);
       }
     }
-  }, [result, refinements, analysisType]);
+  }, [result, refinements, analysisType, currentHistoryId]);
 
   useEffect(() => {
     let interval;
@@ -141,48 +182,70 @@ function App() {
     }
   }, [result]);
 
-  const saveToHistory = (analysisData) => {
+  const saveRefinementsToHistory = async (historyId, updatedRefinements) => {
+    if (!historyId) return;
     try {
-      const newHistory = [
-        {
-          id: Date.now(),
-          ...analysisData
-        },
-        ...history
-      ].slice(0, 50); // Keep last 50 analyses
-      
-      setHistory(newHistory);
-      localStorage.setItem('frameInsight_history', JSON.stringify(newHistory));
+      await axios.put(`${BACKEND_URL}/history/${historyId}/refinements`, { refinements: updatedRefinements });
+      setHistory(prev => prev.map(item =>
+        item.id === historyId ? { ...item, refinement_count: updatedRefinements.length } : item
+      ));
     } catch (error) {
-      console.error('Error saving to history:', error);
+      console.error('Error saving refinements to history:', error);
     }
   };
 
-  const loadFromHistory = (historyItem) => {
-    setResult(historyItem.result);
-    setRefinements(historyItem.refinements || []);
-    setAnalysisType(historyItem.analysisType);
-    setCustomPrompt(historyItem.customPrompt || '');
-    setShowHistory(false);
-    // Scroll to result
-    setTimeout(() => {
-      resultRef.current?.scrollIntoView({ behavior: 'smooth', block: 'start' });
-    }, 100);
+  const loadFromHistory = async (historyItem) => {
+    try {
+      // Summaries are lightweight; fetch the full result only when it is opened
+      const response = await axios.get(`${BACKEND_URL}/history/${historyItem.id}`);
+      const entry = response.data;
+      setResult(entry.result);
+      setRefinements(entry.refinements || []);
+      setAnalysisType(entry.analysis_type);
+      setCustomPrompt(entry.custom_prompt || '');
+      setCurrentHistoryId(entry.id);
+      setShowHistory(false);
+      // Scroll to result
+      setTimeout(() => {
+        resultRef.current?.scrollIntoView({ behavior: 'smooth', block: 'start' });
+      }, 100);
+    } catch (error) {
+      console.error('Error loading history item:', error);
+      alert('Failed to load this analysis.');
+    }
   };
 
-  const deleteHistoryItem = (id) => {
-    const newHistory = history.filter(item => item.id !== id);
-    setHistory(newHistory);
-    localStorage.setItem('frameInsight_history', JSON.stringify(newHistory));
+  const deleteHistoryItem = async (id) => {
+    try {
+      await axios.delete(`${BACKEND_URL}/history/${id}`);
+      setHistory(prev => prev.filter(item => item.id !== id));
+      setHistoryTotal(prev => Math.max(0, prev - 1));
+      if (id === currentHistoryId) setCurrentHistoryId(null);
+    } catch (error) {
+      console.error('Error deleting history item:', error);
+    }
   };
 
-  const clearAllHistory = () => {
+  const clearAllHistory = async () => {
     if (confirm('Are you sure you want to clear all history? This cannot be undone.')) {
-      setHistory([]);
-      localStorage.removeItem('frameInsight_history');
+      try {
+        await axios.delete(`${BACKEND_URL}/history`);
+        setHistory([]);
+        setHistoryTotal(0);
+        setHistoryCursor(null);
+        setCurrentHistoryId(null);
+      } catch (error) {
+        console.error('Error clearing history:', error);
+      }
     }
   };
 
+  const handleHistorySearch = (e) => {
+    e.preventDefault();
+    setSubmittedHistoryQuery(historyQuery);
+    loadHistory(null, historyQuery);
+  };
+
   // Drag and drop handlers
   const handleDragEnter = (e) => {
     e.preventDefault();
@@ -277,17 +340,12 @@ function App() {
         setError(response.data.error);
       } else {
         setResult(response.data);
+        setCurrentHistoryId(response.data.history_id);
         setIsFirstUpload(false);
         console.log("Result set successfully:", response.data);
         
-        // Save to history
-        saveToHistory({
-          result: response.data,
-          analysisType,
-          customPrompt,
-          filename: file?.name || url || 'Unknown',
-          timestamp: new Date().toISOString()
-        });
+        // The backend records history; refresh the first page
+        loadHistory();
       }
       setProgress(100);
     } catch (error) {
@@ -326,7 +384,9 @@ function App() {
               timestamp: new Date().toISOString()
           };
           
-          setRefinements([...refinements, newRefinement]);
+          const updatedRefinements = [...refinements, newRefinement];
+          setRefinements(updatedRefinements);
+          saveRefinementsToHistory(currentHistoryId, updatedRefinements);
           
           // Clear the specific prompt
           setRefinementPrompts(prev => {
@@ -488,7 +548,7 @@ function App() {
              >
                 <FontAwesomeIcon icon={faHistory} />
                 <span className="nav-link-text">History</span>
-                {history.length > 0 && <span className="history-badge">{history.length}</span>}
+                {historyTotal > 0 && <span className="history-badge">{historyTotal}</span>}
              </button>
              <a href="https://github.com/smile4fun1/video-to-prompt" target="_blank" rel="noopener noreferrer" className="nav-link">
                 <FontAwesomeIcon icon={faGithub} />
@@ -511,11 +571,20 @@ function App() {
               <button onClick={() => setShowHistory(false)} className="close-history-btn">×</button>
             </div>
           </div>
+          <form className="history-search" onSubmit={handleHistorySearch}>
+            <input
+              type="search"
+              value={historyQuery}
+              onChange={(e) => setHistoryQuery(e.target.value)}
+              placeholder="Search analyses..."
+              className="history-search-input"
+            />
+          </form>
           <div className="history-content">
             {history.length === 0 ? (
               <div className="history-empty">
                 <FontAwesomeIcon icon={faClock} className="empty-icon" />
-                <p>No analysis history yet</p>
+                <p>{submittedHistoryQuery.trim() ? 'No matching analyses' : 'No analysis history yet'}</p>
                 <p className="empty-subtext">Your past analyses will appear here</p>
               </div>
             ) : (
@@ -524,9 +593,9 @@ function App() {
                   <div key={item.id} className="history-item">
                     <div className="history-item-header">
                       <div className="history-item-info">
-                        <h3 className="history-filename">{item.filename}</h3>
+                        <h3 className="history-filename">{item.source}</h3>
                         <p className="history-timestamp">
-                          {new Date(item.timestamp).toLocaleString()}
+                          {new Date(item.created_at * 1000).toLocaleString()}
                         </p>
                       </div>
                       <div className="history-item-actions">
@@ -547,16 +616,26 @@ function App() {
                       </div>
                     </div>
                     <div className="history-item-meta">
-                      <span className="history-badge">{item.analysisType?.replace(/_/g, ' ')}</span>
-                      <span className="history-frames">{item.result?.frames_extracted || 0} frames</span>
+                      <span className="history-badge">{item.analysis_type?.replace(/_/g, ' ')}</span>
+                      <span className="history-frames">{item.frames_extracted || 0} frames</span>
+                      {item.refinement_count > 0 && (
+                        <span className="history-frames">{item.refinement_count} refinements</span>
+                      )}
                     </div>
                     <div className="history-preview">
-                      {typeof item.result?.analysis === 'string' 
-                        ? item.result.analysis.substring(0, 150) + '...' 
-                        : 'Analysis completed'}
+                      {item.preview ? item.preview.substring(0, 150) + '...' : 'Analysis completed'}
                     </div>
                   </div>
                 ))}
+                {historyCursor && (
+                  <button
+                    onClick={() => loadHistory(historyCursor, submittedHistoryQuery)}
+                    className="history-load-more-btn"
+                    disabled={historyLoading}
+                  >
+                    {historyLoading ? 'Loading...' : 'Load more'}
+                  </button>
+                )}
               </div>
             )}
           </div>